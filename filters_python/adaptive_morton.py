@@ -0,0 +1,214 @@
+import sys,time,random
+from morton import *
+from keys import label_offsets
+
+class AdaptiveMortonFilter(MortonFilter):
+    """Morton filter that removes the false positives it is told about,
+    in the spirit of the adaptive cuckoo filters.
+    Every bucket has a selector (selector_bits wide) that picks the seed of the fingerprint
+    function used in that bucket. When a query is confirmed to be a false positive,
+    adapt() changes the selector of the bucket it matched in and re-fingerprints the
+    items of that bucket, so that the query does not match anymore.
+    Re-fingerprinting needs the items, so the filter keeps them (the remote representation).
+    Alternate buckets are always computed with the default fingerprint (selector 0),
+    so the position of the items does not change and selector 0 buckets stay
+    compatible with the data plane. Once a bucket is adapted, to_bytes() and serialize()
+    refuse to export the filter, since the images do not carry the selectors."""
+    def __init__(self,no_blocks,selector_bits=2,**kwargs):
+        super().__init__(no_blocks,**kwargs)
+        self.selector_bits = selector_bits
+        self.selectors = bytearray(no_blocks*self.no_buckets) # one selector per bucket
+        self.items = [] # the inserted items
+        self.has_items = True # false for filters loaded from an image, which come without their items
+        self.candidates = None # bucket -> items that hash to the bucket (h1 or h2), built on first adapt
+        self.dirty = set() # blocks changed since the last delta()
+        self.adapted = False
+
+    def insert(self,item,verbose=False):
+        if self.adapted:
+            # res_conflict moves fingerprints to the alternate bucket of their stored value,
+            # which is not the default fingerprint in adapted buckets
+            raise Exception('insert after adapt is not supported, rebuild the filter')
+        super().insert(item,verbose)
+        self.items.append(item)
+        return
+
+    def merge(self,other,verbose=False):
+        if self.adapted or getattr(other,"adapted",False):
+            raise Exception('merge of adapted filters is not supported, rebuild the filter')
+        # adapt_bucket re-fingerprints a bucket from the items, the fingerprints of
+        # a filter without items would be lost
+        if not isinstance(other,AdaptiveMortonFilter) or not other.has_items:
+            raise Exception('merge needs an adaptive filter that has its items')
+        super().merge(other,verbose)
+        self.items.extend(other.items)
+        self.candidates = None
+        return
+
+    @classmethod
+    def from_bytes(cls,data,no_blocks,**kwargs):
+        filter = super().from_bytes(data,no_blocks,**kwargs)
+        filter.has_items = False
+        return filter
+
+    def bucket_fingerprint(self,item,glbi):
+        """Returns the fingerprint of item in bucket glbi, according to the bucket selector."""
+        return fingerprint(item,self.fingerprint_size,self.selectors[glbi])
+
+    def match_in(self,item,glbi):
+        """Returns true if the fingerprint of item is in bucket glbi."""
+        blk = self.Blocks[glbi//self.no_buckets]
+        return blk.read_and_cmp(glbi % self.no_buckets, self.bucket_fingerprint(item,glbi))
+
+    def matching_bucket(self,item,skip=None):
+        """Returns the bucket in which a query for item succeeds or None.
+        If skip is given, that bucket is not searched."""
+        glbi1 = self.h1(item)
+        if glbi1 != skip and self.match_in(item,glbi1):
+            return glbi1
+        block1 = self.Blocks[glbi1//self.no_buckets]
+        if not block1.get_OTA(glbi1 % self.no_buckets):
+            return None
+        glbi2 = self.h2(item)
+        if glbi2 != skip and self.match_in(item,glbi2):
+            return glbi2
+        return None
+
+    def check(self,item,verbose=False):
+        return self.matching_bucket(item) is not None
+
+    def check_hash(self,h,verbose=False,t0=None):
+        # a hash only gives the selector 0 fingerprint, adapted buckets need the item
+        if self.adapted:
+            raise Exception('check_hash is not supported after adapt, use check')
+        return super().check_hash(h,verbose,t0)
+
+    def serialize(self):
+        # the images have no selectors, the names in adapted buckets would not be found from them
+        if self.adapted:
+            raise Exception('an adapted filter has no data plane image, use delta() for userspace copies')
+        return super().serialize()
+
+    def to_bytes(self):
+        if self.adapted:
+            raise Exception('an adapted filter has no data plane image, use delta() for userspace copies')
+        return super().to_bytes()
+
+    def check_suffixes(self,name):
+        # the fingerprints depend on the selectors, so the suffixes cannot go through check_hash
+        for offset in label_offsets(name):
+            if self.check(name[offset:]):
+                return name[offset:]
+        return None
+
+    def check_suffixes_many(self,names):
+        return [self.check_suffixes(name) for name in names]
+
+    def build_candidates(self):
+        self.candidates = {}
+        for item in self.items:
+            glbi1 = self.h1(item)
+            glbi2 = self.h2(item)
+            self.candidates.setdefault(glbi1,[]).append(item)
+            if glbi2 != glbi1:
+                self.candidates.setdefault(glbi2,[]).append(item)
+        return
+
+    def adapt_bucket(self,glbi,item,verbose=False):
+        """Changes the selector of bucket glbi so that item does not match in it.
+        Returns true on success."""
+        if self.candidates is None:
+            self.build_candidates()
+        blk = self.Blocks[glbi//self.no_buckets]
+        lbi = glbi % self.no_buckets
+        cap = blk.bucket_capacity(lbi)
+        # the items that are found only through this bucket must stay in it
+        members = [x for x in self.candidates.get(glbi,[])
+                   if self.match_in(x,glbi) and self.matching_bucket(x,skip=glbi) is None]
+        current = self.selectors[glbi]
+        no_selectors = 1 << self.selector_bits
+        for step in range(1,no_selectors):
+            selector = (current + step) % no_selectors
+            query_fp = fingerprint(item,self.fingerprint_size,selector)
+            fps = []
+            for x in members:
+                fp = fingerprint(x,self.fingerprint_size,selector)
+                if fp not in fps:
+                    fps.append(fp)
+            if query_fp in fps or len(fps) > cap:
+                continue
+            if (not fps):
+                # no item needs this bucket, any fingerprint other than the query's will do
+                fps.append(fill_bits(int(query_fp,2) % ((1 << self.fingerprint_size) - 1) + 1,self.fingerprint_size))
+            # duplicates of a fingerprint keep the bucket capacity without adding false positives
+            fps = fps + [fps[0]]*(cap - len(fps))
+            blk.overwrite_bucket(lbi,fps)
+            self.selectors[glbi] = selector
+            self.version += 1
+            self.dirty.add(blk.no)
+            self.adapted = True
+            if verbose:
+                print(f"bucket {glbi}: selector {current} -> {selector}, {len(members)} members")
+            return True
+        if verbose:
+            print(f"bucket {glbi}: no selector removes the false positive")
+        return False
+
+    def adapt(self,item,verbose=False):
+        """Called for an item confirmed to be a false positive (eg. by an ExactIndex).
+        Returns true if the item does not match anymore."""
+        if not self.has_items:
+            raise Exception('adapt needs the items of the filter, rebuild it instead of loading an image')
+        # the query may match in both of its buckets
+        for i in range(2):
+            glbi = self.matching_bucket(item)
+            if glbi is None:
+                return True
+            if not self.adapt_bucket(glbi,item,verbose):
+                return False
+        return self.matching_bucket(item) is None
+
+    def block_selectors(self,no):
+        """Returns the selectors of the buckets of block no."""
+        return bytes(self.selectors[no*self.no_buckets:(no+1)*self.no_buckets])
+
+    def delta(self):
+        """Returns the blocks changed since the last call, as a dict
+        block number -> (serialized block, selectors of its buckets).
+        The XDP programs only compute the selector 0 fingerprint, so these blocks cannot be
+        loaded in their BPF map: names in adapted buckets would not be found anymore.
+        The delta is for userspace copies of the filter that know the selectors."""
+        changes = {}
+        for no in sorted(self.dirty):
+            changes[no] = (self.Blocks[no].serialize(), self.block_selectors(no))
+        self.dirty = set()
+        return changes
+
+# testing
+if __name__ == '__main__':
+    filter = AdaptiveMortonFilter(100)
+    for i in range(4000):
+        filter.insert("item"+str(i))
+    attack = ["attack"+str(random.randint(0,10000000)) for i in range(20000)]
+    false_positives = [x for x in attack if filter.check(x)]
+    print(f"false positives before adapting: {len(false_positives)}")
+    start = time.time()
+    fixed = 0
+    for x in false_positives:
+        if filter.adapt(x):
+            fixed += 1
+    end = time.time()
+    print(f"adapted {fixed} of {len(false_positives)} false positives in {end-start} seconds")
+    print(f"false positives on replay: {sum(filter.check(x) for x in attack)}")
+    print(f"{len(filter.delta())} blocks changed")
+    for i in range(4000):
+        if not filter.check("item"+str(i)):
+            print("query failed for: item"+str(i))
+            sys.exit(1)
+    try:
+        filter.to_bytes()
+        print("an adapted filter was exported")
+        sys.exit(1)
+    except Exception as e:
+        print(e)
+    print("program ended")
@@ -0,0 +1,167 @@
+import sys,time,random
+import mmh3
+import numpy as np
+from morton import MortonFilter, EvictionError
+from bloom import BloomFilter
+
+# Names learned at runtime (eg. from recent legitimate resolver traffic) must expire,
+# and neither filter can delete. AgingFilter keeps one filter per time window in a ring:
+# inserts go to the newest generation and rotate() drops the oldest one, so a name lives
+# for generations-1 to generations windows without any rebuild.
+
+class AgingFilter:
+    """Ring of generations of Morton or Bloom filters, made by factory (eg. lambda: MortonFilter(100)).
+    All the generations have the same geometry, so a name is hashed once per query
+    and the hashes are reused in every generation."""
+    def __init__(self,factory,generations=4):
+        if generations < 2:
+            raise Exception('an aging filter needs at least 2 generations')
+        self.factory = factory
+        self.ring = [None]*generations # None is an empty generation, created on its first insert
+        self.current = 0 # index of the newest generation
+        self.rotations = 0
+        self.version = 0 # incremented on every change
+        self.kind = None # "morton" or "bloom", from the first generation
+        self.packed = {} # id of a Bloom generation -> (generation, version, its bits as bytes)
+
+    def generation(self):
+        """Returns the newest generation, creating it if it is empty."""
+        gen = self.ring[self.current]
+        if gen is None:
+            gen = self.factory()
+            if self.kind is None:
+                if isinstance(gen,MortonFilter):
+                    self.kind = "morton"
+                elif isinstance(gen,BloomFilter):
+                    self.kind = "bloom"
+                else:
+                    raise Exception('aging filters hold Morton or Bloom filters')
+            self.ring[self.current] = gen
+        return gen
+
+    def live(self):
+        """Returns the non empty generations, newest first."""
+        gens = []
+        for i in range(len(self.ring)):
+            gen = self.ring[(self.current - i) % len(self.ring)]
+            if gen is not None:
+                gens.append(gen)
+        return gens
+
+    def insert(self,item):
+        self.generation().insert(item)
+        self.version += 1
+        return
+
+    def insert_many(self,items):
+        gen = self.generation()
+        for item in items:
+            gen.insert(item)
+        self.version += 1
+        return
+
+    def rotate(self):
+        """Starts a new time window: the oldest generation is dropped and becomes the (empty) newest one."""
+        self.current = (self.current + 1) % len(self.ring)
+        self.packed.pop(id(self.ring[self.current]),None)
+        self.ring[self.current] = None # the new filter is only made on the next insert
+        self.rotations += 1
+        self.version += 1
+        return
+
+    def bloom_bits(self,gen):
+        """Returns the bits of a Bloom generation as packed bytes, cached until the generation changes."""
+        cached = self.packed.get(id(gen))
+        if cached is None or cached[0] is not gen or cached[1] != gen.version:
+            cached = (gen,gen.version,np.frombuffer(gen.bf.tobytes(),dtype=np.uint8))
+            self.packed[id(gen)] = cached
+        return cached[2]
+
+    def check_bloom(self,gens,keys):
+        # bit positions of every key at once (hashes_from), tested on the packed bits of each generation
+        h1 = np.array([mmh3.hash(key,signed=False,seed=0) for key in keys],dtype=np.uint64)
+        h2 = np.array([mmh3.hash(key,signed=False,seed=1) for key in keys],dtype=np.uint64)
+        positions = (h1 + np.arange(5,dtype=np.uint64)[:,None]*h2) % np.uint64(gens[0].size)
+        byte, shift = positions >> np.uint64(3), np.uint64(7) - (positions & np.uint64(7))
+        found = np.zeros(len(keys),dtype=bool)
+        for gen in gens:
+            bits = self.bloom_bits(gen)
+            found |= ((bits[byte] >> shift) & 1).all(axis=0).astype(bool)
+        return found.tolist()
+
+    def check_morton(self,gens,keys):
+        found = [False]*len(keys)
+        pending = list(range(len(keys)))
+        hashes = [mmh3.hash(key,signed=False) for key in keys]
+        for gen in gens:
+            missed = []
+            for i in pending:
+                if gen.check_hash(hashes[i]):
+                    found[i] = True
+                else:
+                    missed.append(i)
+            pending = missed
+            if not pending:
+                break
+        return found
+
+    def check_many(self,items):
+        """Queries a batch: every distinct name is hashed once for all the generations.
+        Bloom generations are tested for the whole batch with NumPy, Morton generations
+        are only probed for the names not found in a newer one."""
+        gens = self.live()
+        if not gens:
+            return [False]*len(items)
+        keys = list(dict.fromkeys(items)) # repeated names are looked up once
+        if self.kind == "bloom":
+            answers = dict(zip(keys,self.check_bloom(gens,keys)))
+        else:
+            answers = dict(zip(keys,self.check_morton(gens,keys)))
+        return [answers[item] for item in items]
+
+    def check(self,item):
+        return self.check_many([item])[0]
+
+    def combined(self):
+        """Returns one filter with the names of all the live generations, for the data plane.
+        Bloom generations are ORed, Morton generations are merged into a new generation,
+        so the factory must size the generations for the names of the whole ring."""
+        result = self.factory()
+        try:
+            for gen in reversed(self.live()):
+                result.merge(gen)
+        except EvictionError:
+            raise EvictionError(f'the {len(self.live())} live generations do not fit in one filter: '
+                'merge needs filters of the same size, so the factory must make generations '
+                'large enough for the names of the whole ring')
+        return result
+
+    def serialize(self):
+        """Returns the combined filter in the output.txt format of its XDP loader."""
+        return self.combined().serialize()
+
+    def to_bytes(self):
+        return self.combined().to_bytes()
+
+# testing
+if __name__ == '__main__':
+    for name,factory in (("morton",lambda: MortonFilter(100)),("bloom",lambda: BloomFilter(100000))):
+        filter = AgingFilter(factory,generations=3)
+        windows = [["w"+str(w)+"item"+str(i) for i in range(1000)] for w in range(5)]
+        start = time.time()
+        for w,items in enumerate(windows):
+            if w:
+                filter.rotate()
+            filter.insert_many(items)
+        end = time.time()
+        # after 5 windows with 3 generations only the last 3 windows are live
+        live = [sum(filter.check_many(items)) for items in windows]
+        print(f"{name}: names found per window {live}, built in {end-start} seconds")
+        if live[2:] != [1000]*3:
+            print("query failed for a live window")
+            sys.exit(1)
+        combined = filter.combined()
+        if not all(combined.check(x) for items in windows[2:] for x in items):
+            print("query failed in the combined filter")
+            sys.exit(1)
+        print(f"{name}: combined image of {len(filter.to_bytes())} bytes")
@@ -1,5 +1,6 @@
 import mmh3
 from bitstring import BitArray
+from keys import suffix_hashes
 
 # input_file = "/home/anastasia/diplomatiki/names/all_names"
 # output_file = "/home/anastasia/diplomatiki/xdp_code/filters/all_names/bloom/output.txt"
@@ -7,37 +8,86 @@ bf_size = 28658448
 #bf_size = 143520
 
 
-def get_hashes(item):
+def get_hashes(item,size=bf_size):
     h1 = mmh3.hash(item,signed=False,seed=0)
     h2 = mmh3.hash(item,signed=False,seed=1)
-    
+    return hashes_from(h1,h2,size)
+
+def hashes_from(h1,h2,size=bf_size):
+    """Double hashing: the 5 bit positions (in a filter of size bits) from the 32-bit mmh3 hashes with seeds 0 and 1."""
     hash1 = h1
     hash2 = (h1 + h2) #& (2 ** 32 - 1) # make it 32-bit
     hash3 = (h1 + 2*h2) #& (2 ** 32 - 1)
     hash4 = (h1 + 3*h2) #& (2 ** 32 - 1)
     hash5 = (h1 + 4*h2) #& (2 ** 32 - 1)
-    hash1 = hash1 % bf_size
-    hash2 = hash2 % bf_size
-    hash3 = hash3 % bf_size
-    hash4 = hash4 % bf_size
-    hash5 = hash5 % bf_size
+    hash1 = hash1 % size
+    hash2 = hash2 % size
+    hash3 = hash3 % size
+    hash4 = hash4 % size
+    hash5 = hash5 % size
     return hash1,hash2,hash3,hash4,hash5
 
 class BloomFilter:
     def __init__(self,bf_size):
         self.bf = BitArray(bf_size)
         self.bf.set(0)
+        self.size = bf_size
+        self.version = 0 # incremented on every change
         return None
     
     def check(self,item):
-        hashes = get_hashes(item)
-        return self.bf[hashes[0]] or self.bf[hashes[1]] or self.bf[hashes[2]] or self.bf[hashes[3]] or self.bf[hashes[4]] 
+        # all 5 bits must be set, as in the XDP program
+        return self.check_hashes(get_hashes(item,self.size))
 
     def insert(self,item):
-        hashes = get_hashes(item)
+        self.version += 1
+        hashes = get_hashes(item,self.size)
         self.bf[hashes[0]] = 1
         self.bf[hashes[1]] = 1
         self.bf[hashes[2]] = 1
         self.bf[hashes[3]] = 1
         self.bf[hashes[4]] = 1
         return None
+
+    def merge(self,other):
+        """Adds the items of other, a Bloom filter of the same size."""
+        if self.bf.len != other.bf.len:
+            raise Exception('merge needs Bloom filters of the same size')
+        self.bf |= other.bf
+        self.version += 1
+        return None
+
+    def check_hashes(self,hashes):
+        return self.bf[hashes[0]] and self.bf[hashes[1]] and self.bf[hashes[2]] and self.bf[hashes[3]] and self.bf[hashes[4]]
+
+    def check_suffixes(self,name):
+        """Returns the longest suffix of the wire format name that is in the filter, or None."""
+        offsets, hashes = suffix_hashes(name,seeds=(0,1))
+        for offset,(h1,h2) in zip(offsets,hashes):
+            if self.check_hashes(hashes_from(h1,h2,self.size)):
+                return name[offset:]
+        return None
+
+    def check_suffixes_many(self,names):
+        """check_suffixes for a batch of names. The suffixes that names of the batch share
+        (eg. their zones) are probed once."""
+        answers = {} # suffix hashes -> check_hashes answer
+        results = []
+        for name in names:
+            offsets, hashes = suffix_hashes(name,seeds=(0,1))
+            found = None
+            for offset,key in zip(offsets,hashes):
+                if key not in answers:
+                    answers[key] = self.check_hashes(hashes_from(key[0],key[1],self.size))
+                if answers[key]:
+                    found = name[offset:]
+                    break
+            results.append(found)
+        return results
+
+    def serialize(self):
+        """Returns the bits as a string of 0 and 1, the output.txt format of the XDP loader."""
+        return self.bf.bin
+
+    def to_bytes(self):
+        return self.bf.tobytes()
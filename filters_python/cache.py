@@ -0,0 +1,118 @@
+import sys,time,random
+from collections import OrderedDict
+
+class SegmentedLRU:
+    """Segmented LRU set of keys.
+    New keys enter the probation segment and move to the protected segment on their second hit.
+    Keys that are seen once (eg. random attack names) only ever evict each other from probation,
+    so a scan cannot flush the hot keys out of the protected segment."""
+    def __init__(self,capacity,protected_ratio=0.8):
+        self.protected_capacity = max(1,int(capacity*protected_ratio))
+        self.probation_capacity = max(1,capacity - self.protected_capacity)
+        self.probation = OrderedDict() # least recently used first
+        self.protected = OrderedDict()
+
+    def __len__(self):
+        return len(self.probation) + len(self.protected)
+
+    def __contains__(self,key):
+        return key in self.protected or key in self.probation
+
+    def get(self,key):
+        """Returns true if key is cached and marks it as recently used."""
+        if key in self.protected:
+            self.protected.move_to_end(key)
+            return True
+        if key in self.probation:
+            # second hit, promote
+            del self.probation[key]
+            self.protected[key] = None
+            if len(self.protected) > self.protected_capacity:
+                # the least recently used protected key gets a second chance in probation
+                demoted,_ = self.protected.popitem(last=False)
+                self.put(demoted)
+            return True
+        return False
+
+    def put(self,key):
+        if key in self:
+            return
+        self.probation[key] = None
+        if len(self.probation) > self.probation_capacity:
+            self.probation.popitem(last=False)
+
+    def clear(self):
+        self.probation.clear()
+        self.protected.clear()
+
+class CachedFilter:
+    """Cache of positive answers in front of a filter, keyed by the wire format name.
+    Legitimate traffic is skewed towards few names, so their queries skip hashing and probing.
+    Negative answers are not cached: they are what the random names of an attack get.
+    The cache is dropped when the version of the filter changes (inserts, adapt)."""
+    def __init__(self,filter,capacity=4096,protected_ratio=0.8):
+        self.filter = filter
+        self.cache = SegmentedLRU(capacity,protected_ratio)
+        # the filters increment their version on every change (insert, merge, adapt, rotate),
+        # a filter without one is assumed never to change
+        self.version = getattr(filter,"version",0)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def check(self,item):
+        version = getattr(self.filter,"version",0)
+        if version != self.version:
+            self.cache.clear()
+            self.version = version
+            self.invalidations += 1
+        if self.cache.get(item):
+            self.hits += 1
+            return True
+        self.misses += 1
+        result = self.filter.check(item)
+        if result:
+            self.cache.put(item)
+        return result
+
+    def check_many(self,items):
+        return [self.check(item) for item in items]
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits/lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "hits":self.hits,
+            "misses":self.misses,
+            "hit_rate":self.hit_rate(),
+            "invalidations":self.invalidations,
+            "size":len(self.cache)
+        }
+
+# testing
+if __name__ == '__main__':
+    from morton import MortonFilter
+    filter = MortonFilter(100)
+    names = ["item"+str(i) for i in range(4000)]
+    for name in names:
+        filter.insert(name)
+    # zipf-like legitimate traffic mixed with random names
+    weights = [1/(rank+1) for rank in range(len(names))]
+    legit = random.choices(names,weights=weights,k=20000)
+    attack = ["attack"+str(random.randint(0,10000000)) for i in range(20000)]
+    queries = legit + attack
+    random.shuffle(queries)
+    cached = CachedFilter(filter,capacity=500)
+    start = time.time()
+    cached_answers = cached.check_many(queries)
+    end = time.time()
+    print("cached:", end - start, cached.stats())
+    start = time.time()
+    answers = [filter.check(q) for q in queries]
+    end = time.time()
+    print("uncached:", end - start)
+    if answers != cached_answers:
+        print("cached answers differ")
+        sys.exit(1)
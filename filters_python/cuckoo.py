@@ -0,0 +1,179 @@
+import sys,time,random
+import numpy as np
+from keys import key_hashes, suffix_hashes
+from morton import OFFSETS, EvictionError
+
+OFFSETS_ARRAY = np.array(OFFSETS, dtype=np.int64)
+
+class CuckooFilter:
+    """Cuckoo filter with the alternate bucket scheme of the Morton filters.
+    Keys go through the hash-once pipeline of keys.key_hashes: the low 32 bits of the
+    64-bit key hash give the primary bucket and the top fingerprint_size bits the fingerprint.
+    The alternate bucket is bucket +/- OFFSETS[fp % 32] (even-odd partial key cuckoo hashing),
+    which is an involution only if no_buckets is even.
+    The table is a (no_buckets, entries) NumPy array, fingerprint 0 marks an empty slot
+    and every bucket keeps its fingerprints at the front."""
+    def __init__(self,no_buckets,entries=4,fingerprint_size=16,max_kicks=500):
+        if no_buckets % 2:
+            raise Exception('no_buckets must be even')
+        if fingerprint_size > 32:
+            raise Exception('fingerprint_size must be at most 32 bits')
+        self.no_buckets = no_buckets
+        self.entries = entries
+        self.fingerprint_size = fingerprint_size
+        self.max_kicks = max_kicks
+        # smallest (little endian) unsigned type that fits a fingerprint
+        if fingerprint_size <= 8:
+            self.dtype = np.dtype('u1')
+        elif fingerprint_size <= 16:
+            self.dtype = np.dtype('<u2')
+        else:
+            self.dtype = np.dtype('<u4')
+        self.table = np.zeros((no_buckets,entries), dtype=self.dtype)
+        self.fill = np.zeros(no_buckets, dtype=np.uint8) # fingerprints stored in each bucket
+        self.count = 0
+        self.version = 0 # incremented on every change
+        # (bucket, fp) that could not be placed after max_kicks, checked by queries
+        self.victim = None
+
+    def locate(self,hashes):
+        """Returns the primary buckets, fingerprints and alternate buckets for an array of key hashes."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        buckets = ((hashes & np.uint64(0xffffffff)) % np.uint64(self.no_buckets)).astype(np.int64)
+        fps = (hashes >> np.uint64(64 - self.fingerprint_size)).astype(np.int64)
+        fps[fps == 0] = 1 # empty fingerprints are reserved for empty slots
+        return buckets, fps, self.alternate(buckets, fps)
+
+    def alternate(self,buckets,fps):
+        """Vectorized h_prime: the alternate bucket of each (bucket, fingerprint) pair."""
+        offsets = OFFSETS_ARRAY[fps % len(OFFSETS)]
+        return (buckets + np.where(buckets & 1, offsets, -offsets)) % self.no_buckets
+
+    def alternate_one(self,bucket,fp):
+        offset = OFFSETS[fp % len(OFFSETS)]
+        if bucket & 1:
+            return (bucket + offset) % self.no_buckets
+        return (bucket - offset) % self.no_buckets
+
+    def contains_fp(self,bucket,fp):
+        return fp in self.table[bucket,:self.fill[bucket]]
+
+    def store(self,bucket,fp):
+        """Stores fp in bucket, returns false if the bucket is full."""
+        cap = self.fill[bucket]
+        if cap == self.entries:
+            return False
+        self.table[bucket,cap] = fp
+        self.fill[bucket] = cap + 1
+        return True
+
+    def insert_fingerprint(self,bucket1,fp,bucket2):
+        self.version += 1
+        if self.victim is not None:
+            raise EvictionError('eviction error') # the filter is full
+        if self.contains_fp(bucket1,fp) or self.contains_fp(bucket2,fp):
+            return # same fingerprint in a candidate bucket, the item is already covered
+        if self.store(bucket1,fp) or self.store(bucket2,fp):
+            self.count += 1
+            return
+        # both buckets are full, kick fingerprints to their alternate buckets
+        bucket = random.choice((bucket1,bucket2))
+        for kick in range(self.max_kicks):
+            slot = random.randrange(self.entries)
+            old_fp = int(self.table[bucket,slot])
+            self.table[bucket,slot] = fp
+            fp = old_fp
+            bucket = self.alternate_one(bucket,fp)
+            if self.store(bucket,fp):
+                self.count += 1
+                return
+        self.victim = (bucket,fp)
+        self.count += 1
+        raise EvictionError('eviction error') # the filter is too small for the items
+
+    def insert(self,item):
+        self.insert_many([item])
+
+    def insert_many(self,items):
+        buckets, fps, alternates = self.locate(key_hashes(items, len(items)))
+        for b1,fp,b2 in zip(buckets.tolist(), fps.tolist(), alternates.tolist()):
+            self.insert_fingerprint(b1,fp,b2)
+        return
+
+    def check_hashes(self,hashes):
+        """Returns a boolean array, True where the key hash may be in the filter."""
+        buckets, fps, alternates = self.locate(hashes)
+        fps_col = fps.astype(self.dtype)[:,None]
+        found = (self.table[buckets] == fps_col).any(axis=1) | (self.table[alternates] == fps_col).any(axis=1)
+        if self.victim is not None:
+            b, fp = self.victim
+            found |= (fps == fp) & ((buckets == b) | (alternates == b))
+        return found
+
+    def check_many(self,items):
+        return self.check_hashes(key_hashes(items, len(items)))
+
+    def check(self,item):
+        return bool(self.check_many([item])[0])
+
+    def check_suffixes_many(self,names):
+        """Returns for every wire format name its longest suffix that is in the filter, or None.
+        The suffixes of all the names are hashed without copying them and looked up in one batch."""
+        offsets = []
+        hashes = []
+        for name in names:
+            offs, hs = suffix_hashes(name,bits=64)
+            offsets.append(offs)
+            hashes.extend(h[0] for h in hs)
+        found = self.check_hashes(np.array(hashes,dtype=np.uint64)).tolist()
+        results = []
+        pos = 0
+        for name,offs in zip(names,offsets):
+            match = None
+            for i,o in enumerate(offs): # longest first
+                if found[pos+i]:
+                    match = name[o:]
+                    break
+            results.append(match)
+            pos += len(offs)
+        return results
+
+    def check_suffixes(self,name):
+        return self.check_suffixes_many([name])[0]
+
+    def load_factor(self):
+        return self.count / (self.no_buckets*self.entries)
+
+    def to_bytes(self):
+        """Returns the packed image of the filter: no_buckets buckets of entries
+        little endian fingerprints each, so bucket i starts at byte i*entries*itemsize."""
+        return self.table.tobytes()
+
+    @classmethod
+    def from_bytes(cls,data,no_buckets,entries=4,fingerprint_size=16,max_kicks=500):
+        cf = cls(no_buckets,entries,fingerprint_size,max_kicks)
+        cf.table = np.frombuffer(data, dtype=cf.dtype).reshape(no_buckets,entries).copy()
+        cf.fill = np.count_nonzero(cf.table, axis=1).astype(np.uint8)
+        cf.count = int(cf.fill.sum())
+        return cf
+
+# testing
+if __name__ == '__main__':
+    items = ["item"+str(i) for i in range(200000)]
+    cf = CuckooFilter(2**16, entries=4, fingerprint_size=16)
+    start = time.time()
+    cf.insert_many(items)
+    end = time.time()
+    print(f"inserted {len(items)} items in {end-start} seconds, load factor {cf.load_factor()}")
+    start = time.time()
+    found = cf.check_many(items)
+    end = time.time()
+    print(found.all())
+    print("time elapsed:", end - start)
+    negatives = ["neg"+str(i) for i in range(1000000)]
+    print(f"false positive rate: {cf.check_many(negatives).mean()}")
+    loaded = CuckooFilter.from_bytes(cf.to_bytes(), 2**16, entries=4, fingerprint_size=16)
+    if not loaded.check_many(items).all():
+        print("query failed on loaded image")
+        sys.exit(1)
+    print("program ended")
@@ -0,0 +1,84 @@
+import sys,time
+import numpy as np
+from keys import key_hash, key_hashes
+
+class ExactIndex:
+    """Exact membership index of a name set, kept next to a filter
+    to confirm its hits in userspace.
+    The index is a sorted array of the 64-bit key hashes of the names (8 bytes per name),
+    so it can be saved with numpy and memory-mapped back from disk.
+    Two different names collide with probability ~ n^2/2^65, which we ignore."""
+    def __init__(self,hashes):
+        # hashes must be a sorted uint64 array without duplicates
+        self.hashes = hashes
+
+    @classmethod
+    def from_items(cls,items):
+        """Builds the index from an iterable of (wire format) names."""
+        return cls(np.unique(key_hashes(items)))
+
+    @classmethod
+    def load(cls,filename,mmap=True):
+        """Loads an index written by save(). With mmap the array is not read in memory."""
+        return cls(np.load(filename,mmap_mode='r' if mmap else None))
+
+    def save(self,filename):
+        np.save(filename,self.hashes)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def nbytes(self):
+        return self.hashes.nbytes
+
+    def contains_hashes(self,hashes):
+        """Returns a boolean array, True where the key hash is in the index."""
+        hashes = np.asarray(hashes,dtype=np.uint64)
+        if len(self.hashes) == 0:
+            return np.zeros(hashes.shape,dtype=bool)
+        pos = np.searchsorted(self.hashes,hashes)
+        # searchsorted returns len(self.hashes) for hashes past the last element
+        pos[pos == len(self.hashes)] = 0
+        return self.hashes[pos] == hashes
+
+    def contains_many(self,items):
+        return self.contains_hashes(key_hashes(items,len(items)))
+
+    def contains(self,item):
+        return bool(self.contains_hashes([key_hash(item)])[0])
+
+    def verify(self,items,hits):
+        """Second stage check of filter answers.
+        items is a list of names and hits the filter answer for each of them.
+        Returns a boolean array that is True only for the true positives."""
+        hits = np.asarray(hits,dtype=bool)
+        confirmed = np.zeros(len(items),dtype=bool)
+        idx = np.flatnonzero(hits)
+        if len(idx):
+            # only the hits need to be hashed and looked up
+            confirmed[idx] = self.contains_many([items[i] for i in idx])
+        return confirmed
+
+    def false_positive_counts(self,items,hits):
+        """Returns the counts (false positives, negatives) of the filter answers hits for items.
+        The items that are members of the set are not counted as negatives."""
+        hits = np.asarray(hits,dtype=bool)
+        members = self.contains_many(items)
+        false_positives = int(np.count_nonzero(hits & ~members))
+        negatives = int(np.count_nonzero(~members))
+        return false_positives, negatives
+
+# testing
+if __name__ == '__main__':
+    items = ["item"+str(i) for i in range(200000)]
+    index = ExactIndex.from_items(items)
+    print(f"index of {len(index)} names in {index.nbytes()} bytes")
+    queries = ["item"+str(i) for i in range(100000,300000)]
+    start = time.time()
+    found = index.contains_many(queries)
+    end = time.time()
+    print(f"{int(found.sum())} members out of {len(queries)} queries")
+    print("time elapsed:", end - start)
+    if found.sum() != 100000:
+        print("lookup failed")
+        sys.exit(1)
@@ -0,0 +1,267 @@
+import os,sys,time,math,random,argparse,tempfile
+from collections import OrderedDict
+from itertools import islice
+import mmh3
+import numpy as np
+from morton import *
+from keys import read_names, wire_format
+
+# Out-of-core build of a Morton filter, for name lists that do not fit in memory.
+# 1. the names are streamed from disk and hashed in chunks, every chunk becomes a run of
+#    (bucket, fingerprint) records sorted by primary bucket (and so by primary block)
+# 2. while there are more than fan_in runs, groups of fan_in runs are merged into longer runs,
+#    so that a merge keeps at most fan_in files open and fan_in buffers in memory
+# 3. the last runs are merged and the records are inserted in block order into the packed
+#    image of the filter (MortonFilter.to_bytes layout), a memory-mapped file of which
+#    only an LRU cache of blocks is kept as Block objects.
+# Evictions and secondary buckets reach at most max(OFFSETS) buckets away from the
+# current block, so the cache holds the neighbourhood of the merge position.
+# Memory is bounded by the budget, whatever the number of names.
+
+RECORD_BYTES = 40 # hash, bucket, fingerprint, record and sorted copy of one name in a chunk
+BLOCK_OBJECT_BYTES = 4096 # upper bound of a Block with its BitArrays in memory
+MAX_FAN_IN = 64 # runs merged at once, each one keeps a file open
+
+def count_names(filename):
+    count = 0
+    with open(filename,"r") as f:
+        for line in f:
+            if line.strip():
+                count += 1
+    return count
+
+def make_block(no,filter_attr):
+    return Block(no,block_size=filter_attr["block_size"],
+        fingerprint_size=filter_attr["fingerprint_size"],
+        overflow_bits=filter_attr["ota_bits"],
+        no_buckets=filter_attr["no_buckets"],
+        no_slots=filter_attr["no_slots"],
+        no_fingerprints=filter_attr["no_fingerprints"],
+        checkpoints=filter_attr.get("checkpoints",0))
+
+class BlockStore:
+    """List of the blocks of a packed filter image (eg. an np.memmap), usable as MortonFilter.Blocks.
+    Blocks are loaded on first access and written back when they leave the LRU cache of capacity blocks."""
+    def __init__(self,image,no_blocks,filter_attr,capacity=1024):
+        self.image = image
+        self.no_blocks = no_blocks
+        self.filter_attr = filter_attr
+        self.block_bytes = filter_attr["block_size"]//8
+        self.capacity = capacity
+        self.cache = OrderedDict() # block number -> Block, least recently used first
+        self.loads = 0
+
+    def __len__(self):
+        return self.no_blocks
+
+    def __getitem__(self,no):
+        blk = self.cache.get(no)
+        if blk is not None:
+            self.cache.move_to_end(no)
+            return blk
+        blk = make_block(no,self.filter_attr)
+        blk.load_bytes(bytes(self.image[no*self.block_bytes:(no+1)*self.block_bytes]))
+        self.loads += 1
+        self.cache[no] = blk
+        if len(self.cache) > self.capacity:
+            old_no, old = self.cache.popitem(last=False)
+            self.write(old_no,old)
+        return blk
+
+    def __iter__(self):
+        for no in range(self.no_blocks):
+            yield self[no]
+
+    def write(self,no,blk):
+        self.image[no*self.block_bytes:(no+1)*self.block_bytes] = np.frombuffer(blk.to_bytes(),dtype=np.uint8)
+
+    def flush(self):
+        for no,blk in self.cache.items():
+            self.write(no,blk)
+        if hasattr(self.image,"flush"):
+            self.image.flush()
+        return
+
+def image_filter(image,no_blocks,filter_attr,capacity=1024):
+    """Returns a MortonFilter whose blocks live in image (see BlockStore)."""
+    filter = MortonFilter(0,**filter_attr)
+    filter.no_blocks = no_blocks
+    filter.Blocks = BlockStore(image,no_blocks,filter_attr,capacity)
+    return filter
+
+def hash_chunks(names,chunk_size):
+    """Yields the 32-bit mmh3 hashes of names as uint32 arrays of at most chunk_size."""
+    names = iter(names)
+    while True:
+        hashes = np.fromiter((mmh3.hash(name,signed=False) for name in islice(names,chunk_size)),dtype=np.uint32)
+        if len(hashes) == 0:
+            return
+        yield hashes
+
+def records(hashes,n,fp_size):
+    """Returns the records of the hashes, primary bucket << 32 | fingerprint,
+    as in MortonFilter.insert_hash. Sorting the records sorts them by primary bucket."""
+    h = hashes.astype(np.uint64)
+    glbi = h % np.uint64(n)
+    fp = h >> np.uint64(HASH_SIZE - fp_size)
+    fp[fp == 0] = 1 # empty fingerprints are reserved
+    return (glbi << np.uint64(32)) | fp
+
+def write_runs(names,no_blocks,filter_attr,chunk_size,tmpdir,verbose=False):
+    """Hashes the names chunk by chunk and writes every chunk as a sorted run file.
+    Returns the run file names and the number of records."""
+    n = no_blocks*filter_attr["no_buckets"]
+    runs = []
+    total = 0
+    for hashes in hash_chunks(names,chunk_size):
+        run = np.sort(records(hashes,n,filter_attr["fingerprint_size"]))
+        path = os.path.join(tmpdir,f"run{len(runs)}.bin")
+        run.tofile(path)
+        runs.append(path)
+        total += len(run)
+        if verbose:
+            print(f"run {len(runs)}: {len(run)} records")
+    return runs, total
+
+class RunReader:
+    """Reads a sorted run file buffer_records at a time. The file is closed when the run is used up."""
+    def __init__(self,path,buffer_records):
+        self.f = open(path,"rb")
+        self.buffer_records = buffer_records
+        self.buf = np.empty(0,dtype=np.uint64)
+        self.fill()
+
+    def fill(self):
+        if self.f is not None and len(self.buf) == 0:
+            self.buf = np.fromfile(self.f,dtype=np.uint64,count=self.buffer_records)
+            if len(self.buf) == 0:
+                self.f.close()
+                self.f = None
+        return
+
+    def done(self):
+        return self.f is None
+
+def merge_sorted(runs,buffer_records):
+    """k-way merge of the sorted run files, yields the records in sorted chunks.
+    Every run has one buffer of buffer_records in memory."""
+    readers = [RunReader(path,buffer_records) for path in runs]
+    readers = [r for r in readers if not r.done()]
+    while readers:
+        # the records up to the smallest last buffered record are the next ones of the merge
+        frontier = min(r.buf[-1] for r in readers)
+        parts = []
+        for r in readers:
+            stop = int(np.searchsorted(r.buf,frontier,side="right"))
+            parts.append(r.buf[:stop])
+            r.buf = r.buf[stop:]
+            r.fill()
+        readers = [r for r in readers if not r.done()]
+        yield np.sort(np.concatenate(parts))
+    return
+
+def reduce_runs(runs,tmpdir,fan_in,buffer_records,verbose=False):
+    """Merges groups of fan_in runs into longer runs until at most fan_in runs are left."""
+    level = 0
+    while len(runs) > fan_in:
+        merged = []
+        for i in range(0,len(runs),fan_in):
+            path = os.path.join(tmpdir,f"merge{level}_{len(merged)}.bin")
+            with open(path,"wb") as f:
+                for chunk in merge_sorted(runs[i:i+fan_in],buffer_records):
+                    chunk.tofile(f)
+            for run in runs[i:i+fan_in]:
+                os.remove(run)
+            merged.append(path)
+        if verbose:
+            print(f"merge pass {level}: {len(runs)} runs -> {len(merged)} runs")
+        runs = merged
+        level += 1
+    return runs
+
+def merge_runs(runs,buffer_records):
+    """Final merge of the runs, yields the sorted records in chunks, without duplicates."""
+    last = None
+    for chunk in merge_sorted(runs,buffer_records):
+        # the same (bucket, fingerprint) twice is a duplicate, as for insert_hash
+        chunk = np.unique(chunk)
+        if last is not None and len(chunk) and chunk[0] == last:
+            chunk = chunk[1:]
+        if len(chunk):
+            last = chunk[-1]
+            yield chunk
+    return
+
+def external_build(names,output,no_blocks,filter_attr,memory=256 << 20,max_evictions=8000,tmpdir=None,seed=0,
+    fan_in=MAX_FAN_IN,verbose=False):
+    """Builds a Morton filter of no_blocks from the iterable names into the packed image file output.
+    memory is the budget in bytes, split between the hash chunks (or the merge buffers) and the block cache.
+    Returns the number of records inserted."""
+    random.seed(seed)
+    chunk_size = max(1024,memory//2//RECORD_BYTES)
+    buffer_records = max(1024,chunk_size//fan_in) # the fan_in merge buffers fill a chunk
+    capacity = max(4*math.ceil(max(OFFSETS)/filter_attr["no_buckets"]),memory//2//BLOCK_OBJECT_BYTES)
+    with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+        start = time.time()
+        runs, total = write_runs(names,no_blocks,filter_attr,chunk_size,tmp,verbose)
+        if verbose:
+            print(f"{total} names hashed in {len(runs)} runs in {time.time()-start:.1f} seconds")
+        runs = reduce_runs(runs,tmp,fan_in,buffer_records,verbose)
+        image = np.memmap(output,dtype=np.uint8,mode="w+",shape=(no_blocks*filter_attr["block_size"]//8,))
+        filter = image_filter(image,no_blocks,filter_attr,capacity)
+        filter.max_evictions = max_evictions
+        inserted = 0
+        start = time.time()
+        for chunk in merge_runs(runs,buffer_records):
+            glbis = (chunk >> np.uint64(32)).tolist()
+            fps = (chunk & np.uint64(0xffffffff)).tolist()
+            for glbi,fp in zip(glbis,fps):
+                fp = fill_bits(fp,filter.fingerprint_size)
+                if filter.check_fingerprint(glbi,fp):
+                    continue # as insert_hash, a fingerprint that is already found is not added
+                filter.insert_fingerprint(glbi,fp)
+                inserted += 1
+        filter.Blocks.flush()
+        if verbose:
+            print(f"{inserted} fingerprints inserted in {time.time()-start:.1f} seconds, "
+                  f"{filter.Blocks.loads} block loads with a cache of {capacity} blocks")
+        del image
+    return inserted
+
+def image_to_text(image,no_blocks,filter_attr,output):
+    """Writes a packed image in the output.txt format of the XDP loaders (MortonFilter.serialize), block by block."""
+    block_bytes = filter_attr["block_size"]//8
+    data = np.memmap(image,dtype=np.uint8,mode="r")
+    with open(output,'w') as f:
+        for no in range(no_blocks):
+            blk = make_block(no,filter_attr)
+            blk.load_bytes(bytes(data[no*block_bytes:(no+1)*block_bytes]))
+            f.write(blk.serialize() + '\n')
+    return
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a Morton filter from a name list larger than memory.")
+    parser.add_argument("names", help="file with one name per line")
+    parser.add_argument("image", help="where to write the packed filter image")
+    parser.add_argument("--text", help="also write the filter in output.txt format")
+    parser.add_argument("--geometry", default="512_3_8", choices=sorted(GEOMETRIES))
+    parser.add_argument("--suffix", default="", help="zone appended to every name, eg. example.com for the ntua list")
+    parser.add_argument("--no-blocks", type=int, help="default: the driver size for a 0.95 load factor")
+    parser.add_argument("--memory", type=int, default=256, help="memory budget in MB")
+    parser.add_argument("--max-evictions", type=int, default=8000)
+    parser.add_argument("--tmpdir", help="where to write the sorted runs")
+    parser.add_argument("--fan-in", type=int, default=MAX_FAN_IN, help="runs merged at once (open files)")
+    args = parser.parse_args()
+
+    filter_attr = GEOMETRIES[args.geometry]
+    suffix = wire_format(args.suffix) if args.suffix else ""
+    no_blocks = args.no_blocks
+    if no_blocks is None:
+        no_blocks = math.ceil(count_names(args.names)/0.95/filter_attr["no_fingerprints"])
+    start = time.time()
+    external_build(read_names(args.names,suffix),args.image,no_blocks,filter_attr,
+        args.memory << 20,args.max_evictions,args.tmpdir,fan_in=args.fan_in,verbose=True)
+    print(f"filter of {no_blocks} blocks built in {time.time()-start:.1f} seconds")
+    print(f"set NO_BLOCKS = {no_blocks} in morton_filter.h")
+    if args.text:
+        image_to_text(args.image,no_blocks,filter_attr,args.text)
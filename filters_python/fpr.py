@@ -0,0 +1,107 @@
+import sys,time,math
+from statistics import NormalDist
+
+# Sequential false positive rate estimation: the negatives are checked in batches and
+# the measurement stops as soon as the confidence interval of the rate is narrow enough,
+# instead of checking a fixed (large) number of negatives against every filter.
+
+def wilson_interval(k,n,confidence=0.95):
+    """Wilson score interval of a binomial proportion, k successes out of n."""
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf((1 + confidence)/2)
+    p = k/n
+    denominator = 1 + z*z/n
+    center = (p + z*z/(2*n))/denominator
+    half = z*math.sqrt(p*(1 - p)/n + z*z/(4*n*n))/denominator
+    return max(0.0,center - half), min(1.0,center + half)
+
+def clopper_pearson_interval(k,n,confidence=0.95):
+    """Exact (Clopper-Pearson) interval of a binomial proportion, needs scipy."""
+    from scipy.stats import beta # only this interval needs scipy
+    if n == 0:
+        return 0.0, 1.0
+    alpha = 1 - confidence
+    low = beta.ppf(alpha/2,k,n - k + 1) if k > 0 else 0.0
+    high = beta.ppf(1 - alpha/2,k + 1,n - k) if k < n else 1.0
+    return float(low), float(high)
+
+INTERVALS = {
+    "wilson":wilson_interval,
+    "clopper-pearson":clopper_pearson_interval
+}
+
+def answer_many(filter,items):
+    if hasattr(filter,"check_many"):
+        return filter.check_many(items)
+    return [filter.check(item) for item in items]
+
+def estimate_fpr(filter,batches,rel_precision=0.1,confidence=0.95,method="wilson",
+    min_samples=10000,max_samples=None,index=None,verbose=False):
+    """Estimates the false positive rate of filter (anything with check or check_many)
+    on the batches of negative names, eg. Workload.negatives().
+    Stops when the half width of the confidence interval is at most rel_precision times the
+    estimate (after min_samples), after max_samples, or when the batches run out.
+    index is an optional ExactIndex of the members: names of the set are not counted as negatives.
+    Returns a dict with the estimate, its interval and the samples and time used."""
+    interval = INTERVALS[method]
+    start = time.time()
+    false_positives = 0
+    samples = 0
+    no_batches = 0
+    converged = False
+    low, high = 0.0, 1.0
+    for batch in batches:
+        if max_samples is not None and samples + len(batch) > max_samples:
+            batch = batch[:max_samples - samples]
+        hits = answer_many(filter,batch)
+        if index is not None:
+            fp, negatives = index.false_positive_counts(batch,hits)
+        else:
+            fp, negatives = sum(bool(h) for h in hits), len(batch)
+        false_positives += fp
+        samples += negatives
+        no_batches += 1
+        low, high = interval(false_positives,samples,confidence)
+        rate = false_positives/samples if samples else 0.0
+        if verbose:
+            print(f"{samples} negatives, fpr {rate:.6f} [{low:.6f}, {high:.6f}]")
+        if samples >= min_samples and rate > 0 and (high - low)/2 <= rel_precision*rate:
+            converged = True
+            break
+        if max_samples is not None and samples >= max_samples:
+            break
+    return {
+        "fpr":false_positives/samples if samples else 0.0,
+        "low":low,
+        "high":high,
+        "false_positives":false_positives,
+        "samples":samples,
+        "batches":no_batches,
+        "converged":converged,
+        "elapsed":time.time() - start
+    }
+
+def format_estimate(e):
+    return (f"{e['fpr']:.6f} [{e['low']:.6f}, {e['high']:.6f}] from {e['samples']} negatives "
+            f"in {e['elapsed']:.1f} seconds{'' if e['converged'] else ' (not converged)'}")
+
+# testing
+if __name__ == '__main__':
+    from morton import MortonFilter
+    from exact_index import ExactIndex
+    from workload import Workload, top_zones
+    from keys import wire_format
+    names = [wire_format(f"host{i}.zone{i%20}.com") for i in range(5000)]
+    filter = MortonFilter(math.ceil(len(names)/0.95/46))
+    for name in names:
+        filter.insert(name)
+    index = ExactIndex.from_items(names)
+    workload = Workload(names,top_zones(names),attack_ratio=1.0,seed=0)
+    estimate = estimate_fpr(filter,workload.negatives(10000,total=2000000),rel_precision=0.1,index=index)
+    print("wilson:", format_estimate(estimate))
+    try:
+        estimate = estimate_fpr(filter,workload.negatives(10000,total=2000000),rel_precision=0.1,method="clopper-pearson")
+        print("clopper-pearson:", format_estimate(estimate))
+    except ImportError:
+        print("clopper-pearson needs scipy")
@@ -0,0 +1,153 @@
+import sys,time,math,random,argparse
+from multiprocessing import Pool
+from morton import *
+from keys import read_names, wire_format
+from profiling import profile, PROFILER
+from sizing import min_blocks, try_build, load_factor
+
+# Block and MortonFilter accept any partition of the block in FSA, FCA and OTA.
+# This script enumerates the partitions that fit in a block, finds the smallest filter of each
+# one that holds a sample of names (in parallel) and prints a table ranked by a chosen metric.
+
+def enumerate_geometries(block_sizes=(256,512,1024),fingerprint_sizes=(8,16),slot_counts=(3,7),
+    bucket_step=4,min_ratio=1.5,max_ratio=4.5):
+    """Yields the geometries (keyword arguments of MortonFilter) that fit in a block.
+    For every block size, fingerprint size and slots per bucket, the number of buckets varies
+    in steps of bucket_step and the FSA takes the bits left after the FCA and the OTA.
+    Only geometries with min_ratio <= slots/fingerprints <= max_ratio are kept:
+    with fewer slots buckets overflow too often, with more the FCA wastes bits."""
+    for block_size in block_sizes:
+        ota_bits = block_size//32 # 16 bits for a 512-bit block, as in the drivers
+        for fp_size in fingerprint_sizes:
+            for no_slots in slot_counts:
+                fca_bits = math.ceil(math.log2(no_slots))
+                if (1 << fca_bits) <= no_slots:
+                    continue # the counter cannot hold a full bucket
+                # an even number of buckets keeps h_prime an involution
+                for no_buckets in range(bucket_step,block_size,bucket_step):
+                    no_fingerprints = (block_size - ota_bits - no_buckets*fca_bits)//fp_size
+                    if no_fingerprints <= 0:
+                        break
+                    ratio = no_buckets*no_slots/no_fingerprints
+                    if ratio < min_ratio or ratio > max_ratio:
+                        continue
+                    yield {
+                        "block_size":block_size,
+                        "fingerprint_size":fp_size,
+                        "ota_bits":ota_bits,
+                        "no_buckets":no_buckets,
+                        "no_slots":no_slots,
+                        "no_fingerprints":no_fingerprints
+                    }
+
+def geometry_name(filter_attr):
+    a = filter_attr
+    return f"{a['block_size']}_{a['no_slots']}_{a['fingerprint_size']}/{a['no_buckets']}b{a['no_fingerprints']}f"
+
+def random_names(count,suffix,seed=1):
+    """Random labels under suffix, used as negative queries."""
+    rnd = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz0123456789"
+    names = []
+    for i in range(count):
+        label = "".join(rnd.choice(letters) for j in range(rnd.randint(6,16)))
+        names.append(chr(len(label)) + label + suffix)
+    return names
+
+# set in every worker by init_worker, so that the names are sent and hashed once per process
+worker_hashes = None
+worker_negatives = None
+
+def init_worker(items,negatives):
+    global worker_hashes, worker_negatives
+    worker_hashes = [mmh3.hash(item,signed=False) for item in items]
+    worker_negatives = negatives
+
+def evaluate(filter_attr):
+    """Finds the smallest filter of one geometry that holds the names (sizing.min_blocks),
+    then builds and queries it, returns a dict of metrics."""
+    hashes = worker_hashes
+    # the searches and the timed build run with profiling off
+    enabled = PROFILER.enabled
+    PROFILER.enabled = False
+    try:
+        no_blocks, filter = min_blocks(hashes,filter_attr,max_evictions=500)
+        start = time.time()
+        try_build(hashes,no_blocks,filter_attr,max_evictions=500)
+        build_time = time.time() - start
+    finally:
+        PROFILER.enabled = enabled
+    # the same (seeded) build again, for the eviction counters
+    with profile() as prof:
+        try_build(hashes,no_blocks,filter_attr,max_evictions=500)
+        build = prof.snapshot()
+    with profile() as prof:
+        false_positives = 0
+        for item in worker_negatives:
+            if filter.check(item):
+                false_positives += 1
+        queries = prof.snapshot()
+    counters = queries["counters"]
+    probes = counters.get("check.calls",0) + counters.get("check.secondary_probes",0)
+    return {
+        "geometry":geometry_name(filter_attr),
+        "attr":filter_attr,
+        "no_blocks":no_blocks,
+        "fpr":false_positives/len(worker_negatives),
+        "load":load_factor(len(hashes),no_blocks,filter_attr), # the highest load that still builds
+        "bits_per_item":no_blocks*filter_attr["block_size"]/len(hashes),
+        "eviction_rate":build["derived"].get("insert.eviction_rate",0.0),
+        "avg_eviction_depth":build["derived"].get("insert.avg_eviction_depth",0.0),
+        "max_eviction_depth":build["derived"].get("insert.max_eviction_depth",0),
+        "fca_scan":counters.get("check.fca_scan_buckets",0)/max(1,probes), # buckets scanned per block read
+        "secondary_rate":queries["derived"].get("check.secondary_probe_rate",0.0),
+        "build_time":build_time
+    }
+
+COLUMNS = ["geometry","bits_per_item","fpr","load","eviction_rate","avg_eviction_depth",
+           "max_eviction_depth","fca_scan","secondary_rate","build_time"]
+
+def sweep(items,negatives,geometries,processes=None):
+    """Evaluates the geometries in a process pool, returns the list of results."""
+    with Pool(processes,initializer=init_worker,initargs=(items,negatives)) as pool:
+        return list(pool.imap_unordered(evaluate,geometries))
+
+def print_table(results,sort="bits_per_item"):
+    print(" ".join(f"{c:>18}" for c in COLUMNS))
+    for r in sorted(results,key=lambda r:(r[sort],r["fpr"])):
+        row = []
+        for c in COLUMNS:
+            v = r[c]
+            row.append(f"{v:>18}" if isinstance(v,(str,int)) else f"{v:>18.6g}")
+        print(" ".join(row))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep Morton filter geometries on a sample of names.")
+    parser.add_argument("names", help="file with one name per line")
+    parser.add_argument("--suffix", default="", help="zone appended to every name, eg. example.com for the ntua list")
+    parser.add_argument("--sample", type=int, default=20000, help="number of names to build with")
+    parser.add_argument("--negatives", type=int, default=100000)
+    parser.add_argument("--block-sizes", default="256,512,1024")
+    parser.add_argument("--fingerprint-sizes", default="8,16")
+    parser.add_argument("--slots", default="3,7")
+    parser.add_argument("--bucket-step", type=int, default=4)
+    parser.add_argument("--sort", default="bits_per_item", choices=COLUMNS[1:])
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    suffix = wire_format(args.suffix) if args.suffix else ""
+    items = list(read_names(args.names,suffix))
+    random.seed(0)
+    if len(items) > args.sample:
+        items = random.sample(items,args.sample)
+    negatives = random_names(args.negatives,suffix)
+    geometries = list(enumerate_geometries(
+        block_sizes=[int(x) for x in args.block_sizes.split(",")],
+        fingerprint_sizes=[int(x) for x in args.fingerprint_sizes.split(",")],
+        slot_counts=[int(x) for x in args.slots.split(",")],
+        bucket_step=args.bucket_step))
+    print(f"{len(geometries)} geometries, {len(items)} names, {len(negatives)} negatives")
+    start = time.time()
+    results = sweep(items,negatives,geometries,args.processes)
+    print(f"sweep took {time.time()-start:.1f} seconds")
+    print_table(results,args.sort)
@@ -0,0 +1,73 @@
+import mmh3
+import numpy as np
+
+# Helpers shared by the filters and the benchmarks to turn names into keys.
+# Names are stored in DNS wire format without the terminating zero label,
+# i.e. every label is prefixed by its length: 3www7example3com
+
+def wire_format(name):
+    """Converts a dotted name (eg. www.example.com) to the label sequence the filters store."""
+    item = ""
+    for token in name.rstrip().rstrip(".").split("."):
+        item = item + chr(len(token)) + token
+    return item
+
+def read_names(filename,suffix=""):
+    """Streams the names of filename (one per line) in wire format.
+    suffix is appended to every item, eg. the wire format of the zone for the ntua list."""
+    with open(filename,"r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            yield wire_format(line) + suffix
+
+def read_weighted_names(filename,suffix=""):
+    """Streams (name in wire format, weight) from a file of "name count" lines,
+    eg. the query counts of a resolver log. A line without a count has weight 1."""
+    with open(filename,"r") as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens:
+                continue
+            weight = float(tokens[1]) if len(tokens) > 1 else 1.0
+            yield wire_format(tokens[0]) + suffix, weight
+
+def key_hash(item):
+    """Returns the 64-bit key hash of an item."""
+    return mmh3.hash64(item,signed=False)[0]
+
+def key_hashes(items,count=-1):
+    """Returns the 64-bit key hashes of items as a NumPy uint64 array.
+    items can be any iterable (eg. a generator), count is a hint for preallocation."""
+    return np.fromiter((mmh3.hash64(item,signed=False)[0] for item in items),dtype=np.uint64,count=count)
+
+def label_offsets(name):
+    """Returns the offset of every label of a wire format name.
+    name[offset:] for each offset are the suffixes of name, longest first:
+    3www7example3com -> 3www7example3com, 7example3com, 3com"""
+    offsets = []
+    i = 0
+    while i < len(name):
+        offsets.append(i)
+        i += ord(name[i]) + 1
+    return offsets
+
+def buffer_hash(view,seed,bits):
+    if bits == 64:
+        return mmh3.mmh3_x64_128_utupledigest(view,seed)[0] # key_hash of the suffix
+    return mmh3.hash_from_buffer(view,seed=seed,signed=False)
+
+def suffix_hashes(name,seeds=(0,),bits=32):
+    """Parses the labels of name once and returns (offsets, hashes), longest suffix first.
+    hashes[i][j] is the 32-bit mmh3 hash of name[offsets[i]:] with seeds[j],
+    or its 64-bit key hash (see key_hash) if bits is 64.
+    The name is encoded once and every suffix is hashed through a memoryview of it, without copying."""
+    offsets = label_offsets(name)
+    if name.isascii():
+        data = memoryview(name.encode())
+        views = [data[offset:] for offset in offsets]
+    else:
+        # label lengths count characters, which are not bytes here
+        views = [name[offset:].encode() for offset in offsets]
+    hashes = [tuple(buffer_hash(view,seed,bits) for seed in seeds) for view in views]
+    return offsets, hashes
@@ -2,13 +2,58 @@ import os,sys,time
 import mmh3
 from bitstring import BitArray, BitStream
 import math,random
+from profiling import PROFILER, perf_counter
+from keys import suffix_hashes
 
 HASH_SIZE = 32
+# this is the table_based alternate bucket method, 
+# C++ implementation uses function_based which is a bit different
+# the same table is loaded in the offsets map of the XDP program
+OFFSETS = [83, 149, 211, 277, 337, 397, 457, 521, 
+          587, 653, 719, 787, 853, 919, 983, 1051, 1117, 1181, 1249, 1319, 1399, 
+          1459, 
+          1511, 1571, 1637, 1699, 1759, 1823, 1889, 1951, 2017, 1579]
+
+# geometries of the filters built by the drivers (keyword arguments of MortonFilter)
+# the name is block size _ slots per bucket _ fingerprint size
+GEOMETRIES = {
+    "512_3_8":{
+        "block_size":512,
+        "fingerprint_size":8,
+        "ota_bits":16,
+        "no_buckets":64,
+        "no_slots":3,
+        "no_fingerprints":46
+    },
+    "512_3_16":{
+        "block_size":512,
+        "fingerprint_size":16,
+        "ota_bits":16,
+        "no_buckets":32,
+        "no_slots":3,
+        "no_fingerprints":27
+    },
+    "512_7_8":{
+        "block_size":512,
+        "fingerprint_size":8,
+        "ota_bits":17,
+        "no_buckets":21,
+        "no_slots":7,
+        "no_fingerprints":54
+    }
+}
 
-def fingerprint(item, fp_size=8):
+class EvictionError(Exception):
+    """Raised when an insert runs out of evictions, in most cases because the filter is too small."""
+    pass
+
+def fingerprint(item, fp_size=8, seed=0):
+        # seed selects an alternative fingerprint function, 0 is the one used by the data plane
+        return fingerprint_from_hash(mmh3.hash(item, seed=seed, signed=False), fp_size) # default hash returns 32-bit
+
+def fingerprint_from_hash(h, fp_size=8):
         # take first fp_size bits as fingerprint to minimize false positives
-        fp = mmh3.hash(item, signed=False)  # default hash returns 32-bit
-        fp = fp >> (HASH_SIZE-fp_size) # no need for mask for msb's
+        fp = h >> (HASH_SIZE-fp_size) # no need for mask for msb's
         if (fp == 0):
             fp = 1 # empty fingerprints are reserved to check if FSA has space
         return fill_bits(fp,fp_size) # pad with leading zeros if necessary        
@@ -21,13 +66,47 @@ def fill_bits(item,no_bits):
     """
     # we add +2 to no_bits to accommodate for characters '0b'
     return format(item,'#0'+str(no_bits+2)+'b')
+def checkpoint_bits(no_fingerprints):
+    """Returns the width of a bucket offset checkpoint, it holds offsets 0 to no_fingerprints."""
+    return math.ceil(math.log2(no_fingerprints+1))
+
+def checkpoint_stride(no_buckets,checkpoints):
+    """Returns the number of buckets between two checkpoints."""
+    stride = math.ceil(no_buckets/(checkpoints+1))
+    if (checkpoints and checkpoints*stride >= no_buckets):
+        raise Exception('too many checkpoints for the buckets of the block')
+    return stride
+
+def checkpoint_geometry(filter_attr,checkpoints):
+    """Returns filter_attr with checkpoints bucket offset checkpoints per block.
+    The checkpoints take the place of fingerprint slots, so no_fingerprints shrinks
+    until FSA, checkpoints, FCA and OTA fit in the block again."""
+    checkpoint_stride(filter_attr["no_buckets"],checkpoints)
+    attr = dict(filter_attr)
+    fca_bits = math.ceil(math.log2(attr["no_slots"]))
+    free = attr["block_size"] - attr["ota_bits"] - attr["no_buckets"]*fca_bits
+    no_fingerprints = free//attr["fingerprint_size"]
+    if checkpoints:
+        while no_fingerprints*attr["fingerprint_size"] + checkpoints*checkpoint_bits(no_fingerprints) > free:
+            no_fingerprints -= 1
+    attr["no_fingerprints"] = no_fingerprints
+    attr["checkpoints"] = checkpoints
+    return attr
+
 class Block:
-    def __init__(self,no,block_size=512,fingerprint_size=8,overflow_bits=16,no_buckets=64,no_slots=3,no_fingerprints=46):
+    def __init__(self,no,block_size=512,fingerprint_size=8,overflow_bits=16,no_buckets=64,no_slots=3,no_fingerprints=46,checkpoints=0):
+        self.block_size = block_size
         self.ota = BitArray(overflow_bits) # initialize Overflow Tracking Array - OTA
         self.fca_bits = math.ceil(math.log2(no_slots))
         self.fca = BitArray(no_buckets*self.fca_bits) # initialize Fullness Counter Array - FCA
         # initialize Fingerprint Storage Array - FSA
         self.fsa = BitArray(no_fingerprints*fingerprint_size)
+        # optional Checkpoint Array, after the FSA: checkpoint j is the offset of bucket (j+1)*cp_stride,
+        # so finding the offset of a bucket scans at most cp_stride-1 FCA counters instead of up to no_buckets-1
+        self.checkpoints = checkpoints
+        self.cp_stride = checkpoint_stride(no_buckets,checkpoints)
+        self.cp_bits = checkpoint_bits(no_fingerprints) if checkpoints else 0
+        self.cpa = BitArray(checkpoints*self.cp_bits)
         self.fp_size = fingerprint_size
         self.no_slots = no_slots
         self.no_buckets = no_buckets
@@ -38,10 +117,33 @@ class Block:
     def serialize(self):
         s = BitArray()
         s.append(self.fsa)
+        s.append(self.cpa)
         s.append(self.fca)
         s.append(self.ota)
         return s.bin
 
+    def to_bytes(self):
+        """Returns the block as block_size/8 bytes, laid out as the struct Block of the XDP program."""
+        s = BitArray()
+        s.append(self.fsa)
+        s.append(self.cpa)
+        s.append(self.fca)
+        s.append(self.ota)
+        s.append(BitArray(self.block_size - s.len)) # unused bits at the end of the block
+        return s.tobytes()
+
+    def load_bytes(self,data):
+        """Loads the block from the output of to_bytes()."""
+        s = BitArray(bytes=data)
+        fsa_end = self.fsa.len
+        cpa_end = fsa_end + self.cpa.len
+        fca_end = cpa_end + self.fca.len
+        self.fsa = s[:fsa_end]
+        self.cpa = s[fsa_end:cpa_end]
+        self.fca = s[cpa_end:fca_end]
+        self.ota = s[fca_end:fca_end + self.ota.len]
+        return
+
     def index_OTA(self,lbi):
         # there are 3 different methods to map fp to ota bit in the notes, we choose the simplest one
         return lbi % (self.ota.len)
@@ -71,17 +173,35 @@ class Block:
         bits = self.fca_bits
         return self.fca[lbi*bits:(lbi+1)*bits].uint
 
+    def set_bucket_capacity(self,lbi,cap):
+        """Writes the FCA counter of bucket lbi and moves the checkpoints of the buckets after it."""
+        bits = self.fca_bits
+        delta = cap - self.bucket_capacity(lbi)
+        self.fca.overwrite(BitArray(fill_bits(cap,bits)),lbi*bits)
+        for j in range(lbi//self.cp_stride,self.checkpoints):
+            self.cpa.overwrite(BitArray(fill_bits(self.checkpoint(j)+delta,self.cp_bits)),j*self.cp_bits)
+        return
+
+    def checkpoint(self,j):
+        return self.cpa[j*self.cp_bits:(j+1)*self.cp_bits].uint
+
+    def bucket_offset(self,lbi):
+        """Returns the index (in # of fingerprints) of the first slot of bucket lbi in the FSA."""
+        # fca is a bitarray, the offset is the sum of the
+        # capacities of all the buckets before lbi,
+        # starting from the last checkpoint before lbi if the block has checkpoints
+        j = lbi//self.cp_stride # 0 without checkpoints, cp_stride is no_buckets
+        offset = self.checkpoint(j-1) if j else 0
+        for i in range(j*self.cp_stride,lbi):
+            offset += self.bucket_capacity(i)
+        return offset
 
     def table_simple_store(self,bucket,fp,verbose=False): ## insert will succeed because we checked it beforehand
-        offset = 0
-        bits = self.fca_bits
         bucket_cap = self.bucket_capacity(bucket)
         if (bucket_cap==self.no_slots or (not self.has_capacity())):
             raise Exception('error in table_store')
         # calculate the bucket offset
-        for i in range(bucket):
-            cap = self.bucket_capacity(i)
-            offset += cap
+        offset = self.bucket_offset(bucket)
         if verbose:
             print("inside table_simple_store")
             print(f"bucket_cap : {bucket_cap}, offset: {offset}")
@@ -90,22 +210,18 @@ class Block:
         # store the fingerprint
         self.fsa.overwrite(BitArray(fp),(offset + bucket_cap)*self.fp_size)
         # increment the fca counter
-        self.fca.overwrite(BitArray(fill_bits(bucket_cap+1,bits)),bucket*bits)
+        self.set_bucket_capacity(bucket,bucket_cap+1)
         return
 
-    def read_and_cmp(self,lbi,fp,verbose=False):
-        """Reads a block at the bucket lbi and returns true if fp is in the block."""
-        offset = 0
+    def read_and_cmp(self,lbi,fp,verbose=False,offset=None):
+        """Reads a block at the bucket lbi and returns true if fp is in the block.
+        offset is the bucket offset, if the caller has already computed it."""
         match = False
         bucket_cap = self.bucket_capacity(lbi)
         if verbose:
             print(f"inside read_and_cmp, bucket_cap : {bucket_cap}.")
-        for i in range(lbi):
-            # fca is a bitarray
-            # we need to count 2 bits for each bucket
-            # hence this weird for loop
-            cap = self.bucket_capacity(i)
-            offset += cap
+        if offset is None:
+            offset = self.bucket_offset(lbi)
         if verbose:
             print(f"searching, offset = {offset}")
         for i in range(bucket_cap):
@@ -125,6 +241,26 @@ class Block:
                 print(f"result of read_and_cmp is {match}.")
                 print("----------")
         return match
+
+    def bucket_fingerprints(self,lbi):
+        """Returns the fingerprints stored in bucket lbi as a list of BitArrays."""
+        offset = self.bucket_offset(lbi)
+        fps = []
+        for i in range(self.bucket_capacity(lbi)):
+            index = offset + i
+            fps.append(self.fsa[index*self.fp_size:(index+1)*self.fp_size])
+        return fps
+
+    def overwrite_bucket(self,lbi,fps):
+        """Overwrites in place the fingerprints of bucket lbi.
+        The bucket keeps its capacity, so fps must have as many fingerprints as the bucket holds."""
+        bucket_cap = self.bucket_capacity(lbi)
+        if (len(fps) != bucket_cap):
+            raise Exception('error in overwrite_bucket')
+        offset = self.bucket_offset(lbi)
+        for i,fp in enumerate(fps):
+            self.fsa.overwrite(BitArray(fp),(offset + i)*self.fp_size)
+        return
         
 
 
@@ -176,11 +312,18 @@ class MortonFilter:
     no_buckets=64,
     ota_bits=16,
     no_slots=3,
-    no_fingerprints=46):
+    no_fingerprints=46,
+    checkpoints=0):
         self.no_blocks = no_blocks
         self.block_size = block_size
         self.fingerprint_size = fingerprint_size
         self.no_buckets = no_buckets
+        self.ota_bits = ota_bits
+        self.no_slots = no_slots
+        self.no_fingerprints = no_fingerprints
+        self.checkpoints = checkpoints # bucket offset checkpoints per block, see checkpoint_geometry()
+        self.max_evictions = 8000 # max times an insert can try evicting a fingerprint
+        self.version = 0 # incremented on every change
         self.Blocks = [] # filter is a list of Blocks
         #initialize the blocks
         for i in range(no_blocks):
@@ -189,7 +332,8 @@ class MortonFilter:
             overflow_bits=ota_bits,
             fingerprint_size=fingerprint_size,
             no_slots=no_slots,
-            no_fingerprints=no_fingerprints) # go with default numbers for now
+            no_fingerprints=no_fingerprints,
+            checkpoints=checkpoints) # go with default numbers for now
             self.Blocks.append(blk)
    
    
@@ -211,13 +355,7 @@ class MortonFilter:
             integer_fp = fx.uint
         else:
             integer_fp = fx # should never reach this branch
-        # this is the table_based alternate bucket method, 
-        # C++ implementation uses function_based which is a bit different
-        offsets = [83, 149, 211, 277, 337, 397, 457, 521, 
-          587, 653, 719, 787, 853, 919, 983, 1051, 1117, 1181, 1249, 1319, 1399, 
-          1459, 
-          1511, 1571, 1637, 1699, 1759, 1823, 1889, 1951, 2017, 1579]
-        offset = offsets[integer_fp % len(offsets)]
+        offset = OFFSETS[integer_fp % len(OFFSETS)]
         return offset
         # return (self.no_buckets + integer_fp % off_range) | 1
     
@@ -236,10 +374,8 @@ class MortonFilter:
         else:
             offset = -self.offset(fp)
         second_hash = first_hash + offset
-        if second_hash >= n:
-            return second_hash - n
-        elif second_hash < 0:
-            return second_hash + n
+        if second_hash >= n or second_hash < 0:
+            return self.map(second_hash,n)
         else:
             return second_hash
     
@@ -253,24 +389,48 @@ class MortonFilter:
             offset = -self.offset(fp)
         temp = bucket_index + offset
         # temp = bucket_index + ((-1)**(bucket_index & 1))*self.offset(fp)
-        # return self.map(temp,n)
-        if temp > n:
-            return temp - n
+        if temp >= n:
+            # filters with less than 2017 buckets can wrap around more than once
+            return self.map(temp,n)
         elif temp < 0:
-            return temp + n
+            return self.map(temp,n)
         else:
             return temp
     
     def insert(self,item,verbose=False):
-        fp = fingerprint(item,self.fingerprint_size)
-        if (self.check(item)):
+        self.insert_hash(mmh3.hash(item,signed=False),verbose,item)
+        return
+
+    def insert_hash(self,h,verbose=False,item=None):
+        """Inserts the item whose 32-bit mmh3 hash is h.
+        Fingerprint and buckets only depend on h, so callers can hash once and reuse it
+        (item is only used in verbose messages)."""
+        self.version += 1
+        prof = PROFILER if PROFILER.enabled else None
+        if prof:
+            start = perf_counter()
+            prof.count("insert.calls")
+        fp = fingerprint_from_hash(h,self.fingerprint_size)
+        if (self.check_hash(h)):
             if verbose:
                 print(f"item: {item} already in filter")
+            if prof:
+                prof.count("insert.duplicates")
+                prof.add_time("insert.total",perf_counter()-start)
             return # if item seems already in the filter,don't add it again
             # that would cause duplicates that are in the same bucket and have the same fingerprint
             # and complicate eviction process
         # global bucket index
-        glbi1 = self.h1(item)
+        glbi1 = self.map(h,self.no_buckets * self.no_blocks)
+        self.insert_fingerprint(glbi1,fp,verbose,item)
+        if prof:
+            prof.add_time("insert.total",perf_counter()-start)
+        return
+
+    def insert_fingerprint(self,glbi1,fp,verbose=False,item=None):
+        """Stores fp with glbi1 as its primary bucket, in the secondary bucket
+        or by evicting other fingerprints (it does not check for duplicates)."""
+        prof = PROFILER if PROFILER.enabled else None
         block1 = self.Blocks[glbi1//self.no_buckets]
         # local (in the block) bucket index -> 0 <= lbi <= no_buckets
         lbi1 = glbi1 % self.no_buckets
@@ -284,7 +444,7 @@ class MortonFilter:
                     print(f"Block 1 overflow or bucket capacity for item: {item}")
                 ## this is where we check h2(item)
                 block1.set_OTA(lbi1,verbose)
-                glbi2 = self.h2(item)
+                glbi2 = self.h_prime(glbi1,fp)
                 block2 = self.Blocks[glbi2//self.no_buckets]
                 lbi2 = glbi2 % self.no_buckets
 
@@ -293,16 +453,22 @@ class MortonFilter:
                         if verbose:
                             print(f"Block 2 overflow or bucket capacity for item: {item}, proceed to conflict res")
                             print("++++++++++++")
+                        if prof:
+                            prof.count("insert.evictions")
                         self.res_conflict(block1,lbi1,fp,verbose)
                 else: # insert will be a success in this branch
                     if verbose:
                         print("storing item at h2")
                         print("++++++++++++") 
+                    if prof:
+                        prof.count("insert.secondary")
                     block2.table_simple_store(lbi2, fp)
         else: # we put item at 'h1'
             if verbose:
                 print("storing item at h1")
                 print("++++++++++++")
+            if prof:
+                prof.count("insert.primary")
             block1.table_simple_store(lbi1,fp,verbose)
         return
         
@@ -352,13 +518,9 @@ class MortonFilter:
             alt_blk.table_simple_store(alt_lbi,old_fp)
         # normally we'd use the code for the delete function
         # for now we copy code from Block.read_and_cmp to find the old_fp in the old_blk and overwrite it with new_fp
-        offset = 0
-        bits = old_blk.fca_bits
         fp_size = old_blk.fp_size
         bucket_cap = old_blk.bucket_capacity(lbi)
-        for i in range(lbi):
-            cap = old_blk.bucket_capacity(i)
-            offset += cap
+        offset = old_blk.bucket_offset(lbi)
         for i in range(bucket_cap): # find the index of the old_fp
             index = offset + i
             item = old_blk.fsa[index*fp_size:(index+1)*fp_size]
@@ -372,7 +534,7 @@ class MortonFilter:
                     # we have the index, so we just shift to the left by fp_size
                     old_blk.fsa[(index)*fp_size::] <<= fp_size
                     # we also need to decrement old_fp bucket capacity
-                    old_blk.fca.overwrite(BitArray(fill_bits(bucket_cap-1,bits)),lbi*bits)
+                    old_blk.set_bucket_capacity(lbi,bucket_cap-1)
                     # then we add the new_fp to its respective bucket
                     lbi2 = gbucket_index2 % self.no_buckets
                     old_blk.table_simple_store(lbi2,new_fp)
@@ -383,7 +545,7 @@ class MortonFilter:
     
     def res_conflict(self,blk1,lbi1,fp,verbose=False):
         # we want to insert fp in its blk1 and lbi1 position
-        max_count = 8000 # max times we can try evicting a fingerprint
+        max_count = self.max_evictions # max times we can try evicting a fingerprint
         count = 0 # current count
         evicted = False
         fp = BitArray(fp)
@@ -393,14 +555,13 @@ class MortonFilter:
             if (cap1 == blk1.no_slots):
                 # we have a bucket overflow
                 # candidate bucket to evict is from the specific bucket
-                offset_fp = 0 # offset (in # of fingerprints) in the blk1.fsa
+                # count how many fingerprints the buckets before have stored
+                offset_fp = blk1.bucket_offset(lbi1) # offset (in # of fingerprints) in the blk1.fsa
                 glbi1 = blk1.no*self.no_buckets + lbi1
-                for i in range(lbi1): # count how many fingerprints the buckets before have stored
-                    cap = blk1.bucket_capacity(i)
-                    offset_fp += cap
                 # offset = offset_fp*fp_size # offset (in bits) in the blk1.fsa
                 for i in range(cap1):
                     candidates.append(blk1.fsa[(offset_fp+i)*blk1.fp_size:(offset_fp+i+1)*blk1.fp_size]) # append the candidate fingerprint
+                candidates = [c for g,c in self.eviction_order([(glbi1,c) for c in candidates])]
                 # check if a fingerprint can go to its alternate bucket
                 for c in candidates:
                     if (self.check_candidate_bucket(glbi1,c)):
@@ -413,7 +574,8 @@ class MortonFilter:
                     # moreover, we need to run the while loop again because the old_fp will need to
                     # evict another fingerprint to go into its alternate bucket
                     # so the old_fp becomes new_fp and the "another fingerprint" becomes the old_fp
-                    c = BitArray(random.choice(candidates))
+                    g,c = self.pick_victim([(glbi1,c) for c in candidates])
+                    c = BitArray(c)
                     self.remove_and_replace(blk1,glbi1,glbi1,c,fp,simple=False) 
                     # this does not copy the old_fp to its secondary bucket
                     # we keep it to  run the while loop again
@@ -442,8 +604,8 @@ class MortonFilter:
                 # check if a fingerprint can go to its alternate bucket
                 if (len(candidates) != blk1.no_fingerprints):
                     print("error in loading eviction candidates from block")
-                for b,old_fp in candidates:
-                    glbi1 = blk1.no*self.no_buckets + b # glbi of the old_fp
+                candidates = self.eviction_order([(blk1.no*self.no_buckets + b,f) for b,f in candidates])
+                for glbi1,old_fp in candidates: # glbi1 is the glbi of the old_fp
                     if (self.check_candidate_bucket(glbi1,old_fp)): # if candidate buckets has enough slots
                         evicted = True
                         self.remove_and_replace(blk1, glbi1, glbi2, old_fp,fp, same_bucket=False)
@@ -453,8 +615,7 @@ class MortonFilter:
                     # moreover, we need to run the while loop again because the old_fp will need to
                     # evict another fingerprint to go into its alternate bucket
                     # so the old_fp becomes new_fp and the "another fingerprint" becomes the old_fp
-                    b,c = random.choice(candidates)
-                    glbi1 = blk1.no*self.no_buckets + b # glbi of the old_fp
+                    glbi1,c = self.pick_victim(candidates) # glbi of the old_fp
                     # just write the new_fp and delete the old, without writing the old in its alternate location
                     c = BitArray(c)
                     self.remove_and_replace(blk1,glbi1,glbi2,c,fp,simple=False,same_bucket=False)
@@ -465,37 +626,157 @@ class MortonFilter:
                     lbi1 = glbi2 % self.no_buckets # this is the alternate (local) bucket
                     blk1 = self.Blocks[glbi2//self.no_buckets] # this is the alternate block
             count+=1
+        if PROFILER.enabled:
+            PROFILER.observe("insert.eviction_depth",count)
         if (count > 75):
             print(f"eviction counter > 75, counter = {count}")
         if (count == max_count):
-            raise Exception('eviction error') # in most cases we haven't created enough blocks for all items
+            raise EvictionError('eviction error') # in most cases we haven't created enough blocks for all items
             # no_blocks*no_fingerprints > no_items
         return
 
+    def eviction_order(self,candidates):
+        """Returns the eviction candidates, a list of (glbi, fp), in the order res_conflict tries to move them."""
+        return candidates
+
+    def pick_victim(self,candidates):
+        """Returns the (glbi, fp) that res_conflict evicts when no candidate can move to its alternate bucket."""
+        return random.choice(candidates)
+
     def check(self,item,verbose=False):
-        fp = fingerprint(item,self.fingerprint_size)
-        glbi1 = self.h1(item)
+        prof = PROFILER if PROFILER.enabled else None
+        if prof:
+            t0 = perf_counter()
+        return self.check_hash(mmh3.hash(item,signed=False),verbose,t0 if prof else None)
+
+    def check_hash(self,h,verbose=False,t0=None):
+        """Queries the item whose 32-bit mmh3 hash is h.
+        t0 is the start time of the query when profiling, so that hashing is accounted for."""
+        prof = PROFILER if PROFILER.enabled else None
+        if prof and t0 is None:
+            t0 = perf_counter()
+        fp = fingerprint_from_hash(h,self.fingerprint_size)
+        glbi1 = self.map(h,self.no_buckets * self.no_blocks)
         block1 = self.Blocks[glbi1//self.no_buckets]
         lbi1 = glbi1 % self.no_buckets
+        if prof:
+            t1 = perf_counter()
+        offset1 = block1.bucket_offset(lbi1)
+        if prof:
+            t2 = perf_counter()
+        match = block1.read_and_cmp(lbi1, fp, verbose, offset1)
+        if prof:
+            t3 = perf_counter()
         ota_bit = block1.get_OTA(lbi1)
+        if prof:
+            t4 = perf_counter()
+            prof.count("check.calls")
+            prof.count("check.fca_scan_buckets",lbi1 % block1.cp_stride)
+            prof.add_time("check.hash",t1-t0)
+            prof.add_time("check.fca_scan",t2-t1)
+            prof.add_time("check.primary_read",t3-t2)
+            prof.add_time("check.ota",t4-t3)
         if verbose:
             print(f"fp = {(int(fp,2))}, block1 = {glbi1//self.no_buckets} lbi1 = {lbi1}, ota_bit = {ota_bit}")
-        match = block1.read_and_cmp(lbi1, fp, verbose)
         if (match or not(ota_bit)):
             if (match and verbose):
                 print(f"found fp = {(int(fp,2))} at block {glbi1//self.no_buckets} and bucket {lbi1}")
+            if prof and match:
+                prof.count("check.primary_matches")
             return match
         else:
-            glbi2 = self.h2(item)
+            glbi2 = self.h_prime(glbi1,fp)
             block2 = self.Blocks[glbi2//self.no_buckets]
             lbi2 = glbi2 % self.no_buckets
             if verbose:
                 print(f"fp = {(int(fp,2))}, block2 = {glbi2//self.no_buckets} lbi2 = {lbi2}")
             match = block2.read_and_cmp(lbi2, fp, verbose) 
+            if prof:
+                prof.count("check.secondary_probes")
+                prof.count("check.fca_scan_buckets",lbi2 % block2.cp_stride)
+                if match:
+                    prof.count("check.secondary_matches")
+                prof.add_time("check.secondary_read",perf_counter()-t4)
             if (match and verbose):
                 print(f"found fp = {(int(fp,2))} at block {glbi2//self.no_buckets} and bucket {lbi2}")    
             return match
     
+    def merge(self,other,verbose=False):
+        """Adds the fingerprints of other to the filter, without the original names.
+        Both filters must have the same geometry and number of blocks (and so the same hashing).
+        A stored fingerprint is in one of the two buckets of its item, and h_prime gives the
+        other one, so every fingerprint of other is re-inserted from the bucket it is in."""
+        if other.attr() != self.attr() or other.no_blocks != self.no_blocks:
+            raise Exception('merge needs filters of the same geometry')
+        self.version += 1
+        # the OTA bits of other mark the primary buckets of its items that are stored in their secondary
+        for blk,other_blk in zip(self.Blocks,other.Blocks):
+            blk.ota |= other_blk.ota
+        for other_blk in other.Blocks:
+            index = 0 # fingerprint index in the fsa, buckets are stored in order
+            for lbi in range(self.no_buckets):
+                for i in range(other_blk.bucket_capacity(lbi)):
+                    fp = other_blk.fsa[index*other_blk.fp_size:(index+1)*other_blk.fp_size]
+                    self.merge_fingerprint(other_blk.no*self.no_buckets + lbi,'0b' + fp.bin,verbose)
+                    index += 1
+        return
+
+    def check_fingerprint(self,glbi1,fp):
+        """Returns true if fp is found from its primary bucket glbi1, as check_hash does for a hash."""
+        block1 = self.Blocks[glbi1//self.no_buckets]
+        lbi1 = glbi1 % self.no_buckets
+        if block1.read_and_cmp(lbi1,fp):
+            return True
+        if not block1.get_OTA(lbi1):
+            return False
+        glbi2 = self.h_prime(glbi1,fp)
+        return self.Blocks[glbi2//self.no_buckets].read_and_cmp(glbi2 % self.no_buckets,fp)
+
+    def merge_fingerprint(self,glbi,fp,verbose=False):
+        """Adds fp, which another filter stores in bucket glbi (primary or secondary of its item)."""
+        blk = self.Blocks[glbi//self.no_buckets]
+        lbi = glbi % self.no_buckets
+        if blk.read_and_cmp(lbi,fp):
+            return # already in the same bucket
+        alt = self.h_prime(glbi,fp)
+        alt_blk = self.Blocks[alt//self.no_buckets]
+        if alt_blk.read_and_cmp(alt % self.no_buckets,fp):
+            # already in the other bucket of the item, which may be its secondary:
+            # the OTA bit makes queries that start from glbi reach it
+            blk.set_OTA(lbi)
+            return
+        # if glbi is the secondary bucket of the item, its primary OTA bit was copied from other,
+        # if it is the primary, insert_fingerprint sets the OTA bit when it moves fp away
+        self.insert_fingerprint(glbi,fp,verbose)
+        return
+
+    def check_suffixes(self,name):
+        """Returns the longest suffix of the wire format name that is in the filter, or None.
+        Used for wildcard allowlists: a.b.example.com matches if example.com is in the filter.
+        The labels are parsed and the suffixes hashed in one pass, then they are looked up longest first."""
+        offsets, hashes = suffix_hashes(name)
+        for offset,(h,) in zip(offsets,hashes):
+            if self.check_hash(h):
+                return name[offset:]
+        return None
+
+    def check_suffixes_many(self,names):
+        """check_suffixes for a batch of names. The suffixes that names of the batch share
+        (eg. their zones) are probed once."""
+        answers = {} # suffix hash -> check_hash answer
+        results = []
+        for name in names:
+            offsets, hashes = suffix_hashes(name)
+            found = None
+            for offset,(h,) in zip(offsets,hashes):
+                if h not in answers:
+                    answers[h] = self.check_hash(h)
+                if answers[h]:
+                    found = name[offset:]
+                    break
+            results.append(found)
+        return results
+
     def printFilter(self):
         for i,blk in enumerate(self.Blocks):
             print('Block #',i)
@@ -509,6 +790,30 @@ class MortonFilter:
             s = s + block.serialize() + '\n'
         return s
 
+    def attr(self):
+        """Returns the geometry of the filter (keyword arguments of the constructor)."""
+        return {
+            "block_size":self.block_size,
+            "fingerprint_size":self.fingerprint_size,
+            "ota_bits":self.ota_bits,
+            "no_buckets":self.no_buckets,
+            "no_slots":self.no_slots,
+            "no_fingerprints":self.no_fingerprints,
+            "checkpoints":self.checkpoints
+        }
+
+    def to_bytes(self):
+        """Returns the packed image of the filter: the blocks as they are stored in the BPF map."""
+        return b"".join(block.to_bytes() for block in self.Blocks)
+
+    @classmethod
+    def from_bytes(cls,data,no_blocks,**kwargs):
+        filter = cls(no_blocks,**kwargs)
+        block_bytes = filter.block_size//8
+        for i,block in enumerate(filter.Blocks):
+            block.load_bytes(data[i*block_bytes:(i+1)*block_bytes])
+        return filter
+
 def fill_filter(filename,filter):
     pass
 
@@ -0,0 +1,77 @@
+import os,json
+from contextlib import contextmanager
+from time import perf_counter
+
+# Opt-in profiling of the filter operations.
+# The filters check PROFILER.enabled once per operation and only then
+# read the clock and update the counters, so disabled profiling costs one attribute lookup.
+# Enable it for a block of code with:
+#     with profile() as prof:
+#         ...
+#     print(prof.snapshot())
+# or for the whole process with the environment variable MORTON_PROFILE=1.
+
+class Profiler:
+    def __init__(self,enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.counters = {} # name -> count
+        self.timers = {} # name -> seconds
+        self.histograms = {} # name -> {value: count}
+
+    def count(self,name,n=1):
+        self.counters[name] = self.counters.get(name,0) + n
+
+    def add_time(self,name,seconds):
+        self.timers[name] = self.timers.get(name,0.0) + seconds
+
+    def observe(self,name,value):
+        hist = self.histograms.setdefault(name,{})
+        hist[value] = hist.get(value,0) + 1
+
+    def snapshot(self):
+        """Returns the counters, timers and histograms together with a few derived
+        metrics (averages per call), as a dict that can be dumped as json."""
+        derived = {}
+        checks = self.counters.get("check.calls",0)
+        if checks:
+            derived["check.secondary_probe_rate"] = self.counters.get("check.secondary_probes",0) / checks
+            derived["check.avg_fca_scan"] = self.counters.get("check.fca_scan_buckets",0) / checks
+            for name,seconds in self.timers.items():
+                if name.startswith("check."):
+                    derived[name + "_per_call"] = seconds / checks
+        inserts = self.counters.get("insert.calls",0)
+        if inserts:
+            derived["insert.secondary_rate"] = self.counters.get("insert.secondary",0) / inserts
+            derived["insert.eviction_rate"] = self.counters.get("insert.evictions",0) / inserts
+            depths = self.histograms.get("insert.eviction_depth",{})
+            if depths:
+                derived["insert.avg_eviction_depth"] = sum(d*c for d,c in depths.items()) / sum(depths.values())
+                derived["insert.max_eviction_depth"] = max(depths)
+        return {
+            "counters":dict(self.counters),
+            "timers":dict(self.timers),
+            # json keys must be strings
+            "histograms":{name:{str(v):c for v,c in sorted(hist.items())} for name,hist in self.histograms.items()},
+            "derived":derived
+        }
+
+    def to_json(self,filename):
+        with open(filename,"w") as f:
+            json.dump(self.snapshot(),f,indent=2)
+
+PROFILER = Profiler(os.environ.get("MORTON_PROFILE","0") not in ("","0"))
+
+@contextmanager
+def profile(reset=True):
+    """Enables the profiler inside the with block and restores its previous state afterwards."""
+    enabled = PROFILER.enabled
+    if reset:
+        PROFILER.reset()
+    PROFILER.enabled = True
+    try:
+        yield PROFILER
+    finally:
+        PROFILER.enabled = enabled
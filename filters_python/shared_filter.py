@@ -0,0 +1,172 @@
+import sys,time,struct,random
+import mmh3
+from multiprocessing import Pool, shared_memory, resource_tracker
+from morton import *
+
+# A MortonFilter is a list of Block objects, so every process that queries it needs its own copy.
+# Here the filter is kept as its packed image (MortonFilter.to_bytes) in a shared memory
+# segment, and MortonImage answers queries directly on a read-only view of it:
+# N workers query one physical copy of the filter.
+
+MAGIC = b"MRTN"
+VERSION = 2 # 2 adds the checkpoints of the block layout
+# magic, version, no_blocks and the geometry, padded to 64 bytes so that the blocks are cache line aligned
+HEADER = struct.Struct("<4s9I")
+HEADER_SIZE = 64
+
+def pack_header(no_blocks,attr):
+    header = HEADER.pack(MAGIC,VERSION,no_blocks,attr["block_size"],attr["fingerprint_size"],
+        attr["no_buckets"],attr["ota_bits"],attr["no_slots"],attr["no_fingerprints"],attr.get("checkpoints",0))
+    return header + bytes(HEADER_SIZE - len(header))
+
+def unpack_header(data):
+    magic,version,no_blocks,block_size,fp_size,no_buckets,ota_bits,no_slots,no_fingerprints,checkpoints = \
+        HEADER.unpack(bytes(data[:HEADER.size]))
+    if magic != MAGIC or version != VERSION:
+        raise Exception('not a Morton filter image')
+    return no_blocks, {
+        "block_size":block_size,
+        "fingerprint_size":fp_size,
+        "ota_bits":ota_bits,
+        "no_buckets":no_buckets,
+        "no_slots":no_slots,
+        "no_fingerprints":no_fingerprints,
+        "checkpoints":checkpoints
+    }
+
+class MortonImage:
+    """Read-only Morton filter over a packed image (any buffer: bytes, mmap, shared memory).
+    Queries read the blocks as integers and extract the FSA, FCA and OTA fields with shifts,
+    following MortonFilter.check_hash, so the answers are the same as the filter's."""
+    def __init__(self,buf,no_blocks,block_size=512,fingerprint_size=8,no_buckets=64,ota_bits=16,no_slots=3,no_fingerprints=46,checkpoints=0):
+        self.buf = buf
+        self.no_blocks = no_blocks
+        self.block_size = block_size
+        self.block_bytes = block_size//8
+        self.fingerprint_size = fingerprint_size
+        self.no_buckets = no_buckets
+        self.ota_bits = ota_bits
+        self.fca_bits = math.ceil(math.log2(no_slots))
+        self.cp_start = no_fingerprints*fingerprint_size
+        self.cp_bits = checkpoint_bits(no_fingerprints) if checkpoints else 0
+        self.cp_stride = checkpoint_stride(no_buckets,checkpoints)
+        self.fca_start = self.cp_start + checkpoints*self.cp_bits
+        self.ota_start = self.fca_start + no_buckets*self.fca_bits
+        self.n = no_blocks*no_buckets
+        self.shm = None # the shared memory segment, when attached to one
+
+    def field(self,blk,start,width):
+        """Returns width bits of the block starting at bit start (bit 0 is the msb of the first byte)."""
+        return (blk >> (self.block_size - start - width)) & ((1 << width) - 1)
+
+    def read_and_cmp(self,glbi,fp):
+        no = glbi//self.no_buckets
+        lbi = glbi % self.no_buckets
+        blk = int.from_bytes(self.buf[no*self.block_bytes:(no+1)*self.block_bytes],"big")
+        # start from the last checkpoint before lbi (the start of the block without checkpoints)
+        j = lbi//self.cp_stride
+        first = j*self.cp_stride
+        offset = self.field(blk,self.cp_start + (j-1)*self.cp_bits,self.cp_bits) if j else 0
+        # the FCA counters from the checkpoint to lbi, the last one is the capacity of lbi
+        fca = self.field(blk,self.fca_start + first*self.fca_bits,(lbi-first+1)*self.fca_bits)
+        mask = (1 << self.fca_bits) - 1
+        cap = fca & mask
+        for i in range(lbi-first):
+            fca >>= self.fca_bits
+            offset += fca & mask
+        for i in range(cap):
+            if self.field(blk,(offset+i)*self.fingerprint_size,self.fingerprint_size) == fp:
+                return True, blk
+        return False, blk
+
+    def check_hash(self,h):
+        fp = h >> (HASH_SIZE - self.fingerprint_size)
+        if fp == 0:
+            fp = 1
+        glbi1 = h % self.n
+        match, blk = self.read_and_cmp(glbi1,fp)
+        if match:
+            return True
+        if not self.field(blk,self.ota_start + (glbi1 % self.no_buckets) % self.ota_bits,1):
+            return False
+        offset = OFFSETS[fp % len(OFFSETS)]
+        glbi2 = (glbi1 + offset if glbi1 & 1 else glbi1 - offset) % self.n
+        return self.read_and_cmp(glbi2,fp)[0]
+
+    def check(self,item):
+        return self.check_hash(mmh3.hash(item,signed=False))
+
+    def check_many(self,items):
+        return [self.check_hash(mmh3.hash(item,signed=False)) for item in items]
+
+    def close(self):
+        """Releases the view of the shared memory segment (the segment itself stays)."""
+        if self.shm is not None:
+            self.buf.release()
+            self.buf = None
+            self.shm.close()
+            self.shm = None
+
+def share(filter,name=None):
+    """Copies the packed image of filter in a new shared memory segment.
+    Returns the SharedMemory object; its owner must close() and unlink() it when the workers are done."""
+    image = filter.to_bytes()
+    shm = shared_memory.SharedMemory(name=name,create=True,size=HEADER_SIZE + len(image))
+    shm.buf[:HEADER_SIZE] = pack_header(filter.no_blocks,filter.attr())
+    shm.buf[HEADER_SIZE:HEADER_SIZE + len(image)] = image
+    return shm
+
+def open_segment(name):
+    """Opens the shared memory segment name without registering it with the resource tracker.
+    A registered segment is unlinked by the tracker when the process exits, only share() owns the unlink.
+    Unregistering after the open is not enough: workers forked from the owner share its tracker."""
+    if sys.version_info >= (3,13):
+        return shared_memory.SharedMemory(name=name,track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name,rtype: None # SharedMemory imports it on every open
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+def attach(name):
+    """Returns a MortonImage over the shared memory segment name, without copying it."""
+    shm = open_segment(name)
+    no_blocks, attr = unpack_header(shm.buf)
+    size = no_blocks*attr["block_size"]//8
+    view = shm.buf[HEADER_SIZE:HEADER_SIZE + size].toreadonly()
+    image = MortonImage(view,no_blocks,**attr)
+    image.shm = shm
+    return image
+
+# set in every worker by init_worker
+worker_filter = None
+
+def init_worker(name):
+    global worker_filter
+    worker_filter = attach(name)
+
+def count_matches(items):
+    return sum(worker_filter.check_many(items))
+
+# testing
+if __name__ == '__main__':
+    filter = MortonFilter(100)
+    for i in range(4000):
+        filter.insert("item"+str(i))
+    shm = share(filter)
+    try:
+        queries = ["item"+str(i) for i in range(8000)]
+        chunks = [queries[i:i+1000] for i in range(0,len(queries),1000)]
+        start = time.time()
+        with Pool(4,initializer=init_worker,initargs=(shm.name,)) as pool:
+            found = sum(pool.map(count_matches,chunks))
+        end = time.time()
+        expected = sum(filter.check(x) for x in queries)
+        print(f"{found} matches in the workers, {expected} in the filter")
+        print("time elapsed:", end - start)
+        if found != expected:
+            sys.exit(1)
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,127 @@
+import sys,time,math,random,argparse
+import mmh3
+from morton import *
+from keys import read_names, wire_format
+
+# The drivers size the filters for a 0.95 load factor: ceil(len/0.95/no_fingerprints) blocks.
+# min_blocks() searches for the smallest number of blocks with which the
+# construction succeeds, so that the BPF map (and its cache footprint) is as small as possible.
+
+def try_build(hashes,no_blocks,filter_attr,max_evictions=500,seed=0):
+    """Builds a filter of no_blocks from precomputed 32-bit mmh3 hashes.
+    Returns the filter or None if an insert ran out of evictions."""
+    random.seed(seed) # eviction victims are picked at random, keep the trials reproducible
+    filter = MortonFilter(no_blocks,**filter_attr)
+    filter.max_evictions = max_evictions
+    try:
+        for h in hashes:
+            filter.insert_hash(h)
+    except EvictionError:
+        return None
+    return filter
+
+def min_blocks(hashes,filter_attr,max_evictions=500,seed=0,verbose=False):
+    """Binary search for the smallest no_blocks that builds successfully.
+    Returns (no_blocks, filter).
+    Success is not strictly monotonic in the number of blocks, the result is a size
+    that builds while the one below it does not."""
+    nf = filter_attr["no_fingerprints"]
+    # below lo the blocks cannot hold all the fingerprints
+    lo = max(1,math.ceil(len(hashes)/nf)) - 1
+    hi = math.ceil(len(hashes)/0.95/nf) # the size the drivers use
+    best = try_build(hashes,hi,filter_attr,max_evictions,seed)
+    while best is None:
+        # the driver size is not enough either, grow until the build succeeds
+        lo = hi
+        hi = math.ceil(hi*1.05) + 1
+        best = try_build(hashes,hi,filter_attr,max_evictions,seed)
+    if verbose:
+        print(f"search between {lo+1} and {hi} blocks")
+    # invariant: lo fails (or holds too few fingerprints), hi succeeds
+    while hi - lo > 1:
+        mid = (lo + hi)//2
+        start = time.time()
+        filter = try_build(hashes,mid,filter_attr,max_evictions,seed)
+        if verbose:
+            print(f"{mid} blocks: {'ok' if filter else 'failed'} in {time.time()-start:.1f} seconds")
+        if filter is None:
+            lo = mid
+        else:
+            hi = mid
+            best = filter
+    return hi, best
+
+def load_factor(no_items,no_blocks,filter_attr):
+    return no_items/(no_blocks*filter_attr["no_fingerprints"])
+
+def checkpoint_costs(hashes,filter_attr,checkpoints=(0,1,3),no_negatives=100000,max_evictions=500,seed=0):
+    """Trade-off of the bucket offset checkpoints (see checkpoint_geometry).
+    For every number of checkpoints per block, returns the bits spent, the fingerprint slots lost,
+    the longest FCA scan of a lookup, the smallest filter that holds the hashes and its
+    false positive rate on random 32-bit hashes (random names, as mmh3 is uniform)."""
+    members = set(hashes)
+    rng = random.Random(seed)
+    negatives = []
+    while len(negatives) < no_negatives:
+        h = rng.getrandbits(HASH_SIZE)
+        if h not in members:
+            negatives.append(h)
+    base = checkpoint_geometry(filter_attr,0)["no_fingerprints"]
+    rows = []
+    for k in checkpoints:
+        attr = checkpoint_geometry(filter_attr,k)
+        no_blocks, filter = min_blocks(hashes,attr,max_evictions,seed)
+        blk = filter.Blocks[0]
+        rows.append({
+            "checkpoints":k,
+            "checkpoint_bits":blk.cpa.len,
+            "no_fingerprints":attr["no_fingerprints"],
+            "fingerprints_lost":base - attr["no_fingerprints"],
+            "max_scan":blk.cp_stride - 1, # FCA counters summed to find a bucket offset
+            "no_blocks":no_blocks,
+            "bytes":no_blocks*attr["block_size"]//8,
+            "load":load_factor(len(hashes),no_blocks,attr),
+            "fpr":sum(filter.check_hash(h) for h in negatives)/len(negatives)
+        })
+    return rows
+
+def print_costs(rows):
+    print(f"{'checkpoints':>11} {'bits':>5} {'fps':>4} {'lost':>4} {'scan':>4} {'blocks':>7} {'bytes':>9} {'load':>7} {'fpr':>9}")
+    for r in rows:
+        print(f"{r['checkpoints']:>11} {r['checkpoint_bits']:>5} {r['no_fingerprints']:>4} {r['fingerprints_lost']:>4} "
+              f"{r['max_scan']:>4} {r['no_blocks']:>7} {r['bytes']:>9} {r['load']:>7.4f} {r['fpr']:>9.6f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find the smallest Morton filter that holds a name set.")
+    parser.add_argument("names", help="file with one name per line")
+    parser.add_argument("output", help="where to write the filter (output.txt format)")
+    parser.add_argument("--geometry", default="512_3_8", choices=sorted(GEOMETRIES))
+    parser.add_argument("--suffix", default="", help="zone appended to every name, eg. example.com for the ntua list")
+    parser.add_argument("--max-evictions", type=int, default=500)
+    parser.add_argument("--checkpoints", type=int, default=0,
+        help="bucket offset checkpoints per block (layout not supported by the XDP programs yet)")
+    parser.add_argument("--checkpoint-costs", action="store_true",
+        help="print the capacity/fpr cost of 0, 1, 3 and --checkpoints checkpoints")
+    args = parser.parse_args()
+
+    suffix = wire_format(args.suffix) if args.suffix else ""
+    # hash once, every trial reuses the hashes
+    hashes = [mmh3.hash(item,signed=False) for item in read_names(args.names,suffix)]
+    filter_attr = GEOMETRIES[args.geometry]
+    if args.checkpoints:
+        filter_attr = checkpoint_geometry(filter_attr,args.checkpoints)
+    if args.checkpoint_costs:
+        print_costs(checkpoint_costs(hashes,GEOMETRIES[args.geometry],sorted({0,1,3,args.checkpoints}),
+            max_evictions=args.max_evictions))
+    default_blocks = math.ceil(len(hashes)/0.95/filter_attr["no_fingerprints"])
+    start = time.time()
+    no_blocks, filter = min_blocks(hashes,filter_attr,args.max_evictions,verbose=True)
+    end = time.time()
+    print(f"{len(hashes)} names fit in {no_blocks} blocks (driver size {default_blocks}), "
+          f"load factor {load_factor(len(hashes),no_blocks,filter_attr):.4f}, search took {end-start:.1f} seconds")
+    if args.checkpoints:
+        print(f"the blocks have {args.checkpoints} checkpoints, the XDP programs cannot load this layout")
+    else:
+        print(f"set NO_BLOCKS = {no_blocks} in morton_filter.h")
+    with open(args.output,'w') as f:
+        f.write(filter.serialize())
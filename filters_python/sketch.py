@@ -0,0 +1,149 @@
+import sys,time,struct
+import numpy as np
+from keys import key_hashes, label_offsets, wire_format
+
+# Count-min sketch of query counts, to find the zones under a random subdomain attack
+# in fixed memory: the queries of such a zone mostly miss the filters.
+
+class CountMinSketch:
+    """depth rows of width counters. A key is counted in one counter per row and its
+    estimate is the minimum of those counters (never below the true count).
+    The counters of a key come from its 64-bit key hash with double hashing,
+    as the bit positions of bloom.py: (h1 + i*h2) % width for row i."""
+    MAGIC = b"CMS1"
+    HEADER = struct.Struct("<4sIIQ") # magic, width, depth, total
+
+    def __init__(self,width=1 << 16,depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth,width),dtype=np.uint32)
+        self.total = 0 # number of counted queries
+
+    def indexes(self,hashes):
+        hashes = np.asarray(hashes,dtype=np.uint64)
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = hashes >> np.uint64(32)
+        rows = np.arange(self.depth,dtype=np.uint64)[:,None]
+        return ((h1 + rows*h2) % np.uint64(self.width)).astype(np.int64) # (depth, len(hashes))
+
+    def add_hashes(self,hashes,counts=1):
+        idx = self.indexes(hashes)
+        counts = np.broadcast_to(np.asarray(counts,dtype=np.uint32),idx.shape[1:])
+        for row in range(self.depth):
+            np.add.at(self.table[row],idx[row],counts) # add.at sums repeated indexes
+        self.total += int(counts.sum())
+
+    def add_many(self,keys,counts=1):
+        self.add_hashes(key_hashes(keys,len(keys)),counts)
+
+    def add(self,key,count=1):
+        self.add_many([key],count)
+
+    def estimate_hashes(self,hashes):
+        idx = self.indexes(hashes)
+        return self.table[np.arange(self.depth)[:,None],idx].min(axis=0)
+
+    def estimate_many(self,keys):
+        return self.estimate_hashes(key_hashes(keys,len(keys)))
+
+    def estimate(self,key):
+        return int(self.estimate_many([key])[0])
+
+    def decay(self,factor=0.5):
+        """Scales all the counters, so that old windows weigh less than the current one."""
+        if factor == 0.5:
+            self.table >>= 1
+        else:
+            self.table[:] = (self.table*factor).astype(np.uint32)
+        self.total = int(self.total*factor)
+
+    def merge(self,other):
+        if (self.width,self.depth) != (other.width,other.depth):
+            raise Exception('merge needs sketches of the same size')
+        self.table += other.table
+        self.total += other.total
+
+    def to_bytes(self):
+        return self.HEADER.pack(self.MAGIC,self.width,self.depth,self.total) + self.table.astype('<u4').tobytes()
+
+    @classmethod
+    def from_bytes(cls,data):
+        magic,width,depth,total = cls.HEADER.unpack(data[:cls.HEADER.size])
+        if magic != cls.MAGIC:
+            raise Exception('not a count-min sketch image')
+        sketch = cls(width,depth)
+        sketch.table[:] = np.frombuffer(data,dtype='<u4',count=width*depth,offset=cls.HEADER.size).reshape(depth,width)
+        sketch.total = total
+        return sketch
+
+def zone_of(name,labels=2):
+    """Returns the zone (last labels labels) of a wire format name."""
+    offsets = label_offsets(name)
+    return name[offsets[max(0,len(offsets)-labels)]:]
+
+class ZoneTracker:
+    """Counts queries per zone and filter verdict in one count-min sketch
+    (key: '+' or '-' followed by the zone) and keeps the top_k zones with the most misses.
+    With window set, the counts are halved every window queries."""
+    def __init__(self,width=1 << 16,depth=4,labels=2,top_k=32,window=None):
+        self.sketch = CountMinSketch(width,depth)
+        self.labels = labels
+        self.top_k = top_k
+        self.window = window
+        self.since_decay = 0
+        self.heavy = {} # zone -> estimated misses, the heavy hitter candidates
+
+    def update(self,names,verdicts):
+        """Counts a batch of queries, verdicts[i] is the filter answer for names[i]."""
+        zones = [zone_of(name,self.labels) for name in names]
+        self.sketch.add_many([("+" if v else "-") + z for z,v in zip(zones,verdicts)])
+        missed = list({z for z,v in zip(zones,verdicts) if not v})
+        if missed:
+            for zone,misses in zip(missed,self.sketch.estimate_many(["-" + z for z in missed]).tolist()):
+                self.heavy[zone] = misses
+            if len(self.heavy) > self.top_k:
+                keep = sorted(self.heavy,key=self.heavy.get,reverse=True)[:self.top_k]
+                self.heavy = {zone:self.heavy[zone] for zone in keep}
+        self.since_decay += len(names)
+        if self.window and self.since_decay >= self.window:
+            self.decay()
+
+    def decay(self,factor=0.5):
+        self.sketch.decay(factor)
+        self.heavy = {zone:int(count*factor) for zone,count in self.heavy.items()}
+        self.since_decay = 0
+
+    def counts(self,zone):
+        """Returns the estimated (hits, misses) of zone."""
+        hits,misses = self.sketch.estimate_many(["+" + zone,"-" + zone]).tolist()
+        return hits,misses
+
+    def suspects(self,min_misses=100,miss_ratio=0.5):
+        """Returns (zone, hits, misses) of the heavy zones whose queries mostly miss the filter."""
+        result = []
+        for zone in self.heavy:
+            hits,misses = self.counts(zone)
+            if misses >= min_misses and misses >= miss_ratio*(hits + misses):
+                result.append((zone,hits,misses))
+        return sorted(result,key=lambda r:r[2],reverse=True)
+
+# testing
+if __name__ == '__main__':
+    from workload import Workload
+    names = [wire_format(f"host{i}.zone{i%50}.com") for i in range(20000)]
+    known = set(names)
+    victims = [wire_format("zone7.com"),wire_format("zone21.com")]
+    workload = Workload(names,victims,attack_ratio=0.3,seed=1)
+    tracker = ZoneTracker(width=1 << 14,depth=4,window=200000)
+    start = time.time()
+    for batch,is_attack,times in workload.batches(20000,total=400000):
+        tracker.update(batch,[name in known for name in batch])
+    end = time.time()
+    print("time elapsed:", end - start)
+    for zone,hits,misses in tracker.suspects():
+        print(f"{zone!r}: {hits} hits, {misses} misses")
+    image = tracker.sketch.to_bytes()
+    print(f"sketch image of {len(image)} bytes")
+    loaded = CountMinSketch.from_bytes(image)
+    if not (loaded.table == tracker.sketch.table).all():
+        sys.exit(1)
@@ -1,8 +1,9 @@
 import sys,os,time,random
-sys.path.insert(0,"./cuckoo_filter")
-from cuckoo_filter import *
+from cuckoo import *
 from morton import *
 from bloom import *
+from workload import Workload, top_zones
+from fpr import estimate_fpr, format_estimate
 
 
 check_tp_times = False
@@ -29,13 +30,13 @@ bf = BloomFilter(bf_size)
 cf_attr = {
     "buckets":2**24, # 2^19
     "entries":4,
-    "error_rate":0.0003,
+    "fingerprint_size":15, # error_rate 0.0003 -> log2(2*entries/0.0003) bits
     "max_kicks":500
 }
-cf = Cuckoo(
-    buckets=cf_attr["buckets"],
+cf = CuckooFilter(
+    cf_attr["buckets"],
     entries=cf_attr["entries"],
-    error_rate=cf_attr["error_rate"],
+    fingerprint_size=cf_attr["fingerprint_size"],
     max_kicks=cf_attr["max_kicks"]
 )
  # Morton_3_8
@@ -81,8 +82,11 @@ negative_counts = [0,0,0,0]
 # Construction of filters
 for f,f_n in filters_1:
     start = time.time()
-    for name in names:
-        f.insert(name)
+    if hasattr(f,"insert_many"):
+        f.insert_many(names)
+    else:
+        for name in names:
+            f.insert(name)
     end = time.time()
     print(f"{f_n} filter constructed in {end-start} seconds.")
 
@@ -119,32 +123,14 @@ for f,f_n in filters_2:
 # tn_times_cf = []
 # tn_times_bf = []
 # tn_times_cf = []
-neg_names = []
-for i in range(2000000):
-    # check if a random number is in filter (should not be)
-    neg_names.append(str(random.randint(0,10000000)))
-found_bf = 0
-found_cf = 0
-for name in neg_names:
-    # start = int(round(time.time() * 1000))
-    f = bf.check(name)
-    # end = int(round(time.time() * 1000))
-    # t = end - start
-    # tn_times_bf.append(t)
-    if f:
-        found_bf +=1
-    # start = int(round(time.time() * 1000))
-    f = cf.check(name)
-    # end = int(round(time.time() * 1000))
-    # t = end - start
-    # tn_times_cf.append(t)
-    if f:
-        found_cf += 1
-
-# avg_tn_bf = sum(tn_times_bf) / len(tn_times_bf)
-# avg_tn_cf = sum(tn_times_cf) / len(tn_times_cf)
-# print(f"average true negative check in bf:{avg_tn_bf}, found:{found_bf}")
-# print(f"average true negative check in cf:{avg_tn_cf}, found:{found_cf}")
+# random subdomains of the most common zones of the names, as in a water torture attack
+# every filter gets the same stream of negatives (at most 2M) and the estimate stops
+# once its 95% confidence interval is within 5% of the rate
+zones = top_zones(names)
+print("False positive rates:")
+for f,f_n in filters_1 + filters_2:
+    negatives = Workload(names,zones,attack_ratio=1.0,seed=0).negatives(10000,total=2000000)
+    print(f"{f_n}: {format_estimate(estimate_fpr(f,negatives,rel_precision=0.05))}")
 
 # tp_times_mf8 = [] # millisec
 # tp_times_mf16 = []
@@ -171,31 +157,3 @@ for name in neg_names:
 # tp_times_mf16 = []
 # tn_times_mf8 = []
 # tn_times_mf16 = []
-found_mf8 = 0
-found_mf16 = 0
-
-found = False
-for name in names:
-    # start = int(round(time.time() * 1000))
-    found = mf8.check(name)
-    # end = int(round(time.time() * 1000))
-    # t = end - start
-    # tp_times_mf8.append(t)
-    if found:
-        found_mf8 += 1
-    # start = int(round(time.time() * 1000))
-    found = mf16.check(name)
-    # end = int(round(time.time() * 1000))
-    # t = end - start
-    # tp_times_mf16.append(t)
-    if found:
-        found_mf16 += 1
-
-print("False positive rates:")
-all_neg = len(neg_names)
-print(f"Bloom: {found_bf/all_neg}, Cuckoo: {found_cf/all_neg}")
-print(f"Morton8: {found_mf8/all_neg}, Morton16: {found_mf16/all_neg}")
-# avg_tp_mf8 = sum(tp_times_mf8) / len(tp_times_mf8)
-# avg_tp_mf16 = sum(tp_times_mf16) / len(tp_times_mf16)
-# print(f"average true negative check in mf8:{avg_tp_mf8}")
-# print(f"average true negative check in mf16:{avg_tp_mf16}")
\ No newline at end of file
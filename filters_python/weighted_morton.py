@@ -0,0 +1,130 @@
+import sys,time,random
+from morton import *
+from keys import read_weighted_names
+
+# A name stored in its secondary bucket costs every query for it a second block read
+# (a second bpf_map_lookup_elem in the XDP program). Here the names come with query weights
+# (eg. counts from resolver logs): they are inserted heaviest first and evictions move
+# light fingerprints out of their primary buckets before heavy ones.
+
+def fp_key(fp):
+    """Returns fp (binary string or BitArray) as an integer."""
+    if (isinstance(fp,BitArray)):
+        return fp.uint
+    return int(fp,2)
+
+def weighted_pairs(weighted_items):
+    """Accepts a dict item -> weight or an iterable of (item, weight)."""
+    if isinstance(weighted_items,dict):
+        return list(weighted_items.items())
+    return list(weighted_items)
+
+class WeightedMortonFilter(MortonFilter):
+    """Morton filter that keeps the fingerprints of heavy (frequently queried) items in their primary bucket.
+    The filter layout is unchanged, the query weights are only used while building,
+    in a side table (glbi, fp) -> (weight, is_primary) that follows the fingerprints when they move."""
+    def __init__(self,no_blocks,**kwargs):
+        super().__init__(no_blocks,**kwargs)
+        self.placement = {} # (glbi, fp as int) -> (weight, true if glbi is the primary bucket of the item)
+        self.weight = 0 # weight of the item being inserted
+        self.pending = (0,True) # (weight, is_primary) of the fingerprint res_conflict is placing
+
+    def insert(self,item,verbose=False,weight=0):
+        self.weight = weight
+        super().insert(item,verbose)
+        return
+
+    def insert_weighted(self,weighted_items,verbose=False):
+        """Inserts the items in descending weight, so that the heavy ones find free primary buckets."""
+        for item,weight in sorted(weighted_pairs(weighted_items),key=lambda p:p[1],reverse=True):
+            self.insert(item,verbose,weight)
+        return
+
+    def merge(self,other,verbose=False):
+        raise Exception('merge of weighted filters is not supported, rebuild the filter')
+
+    def has_room(self,glbi):
+        blk = self.Blocks[glbi//self.no_buckets]
+        return blk.bucket_capacity(glbi % self.no_buckets) < blk.no_slots and blk.has_capacity()
+
+    def insert_fingerprint(self,glbi1,fp,verbose=False,item=None):
+        # same choice as MortonFilter.insert_fingerprint, to know where fp ends up
+        if self.has_room(glbi1):
+            self.placement[(glbi1,fp_key(fp))] = (self.weight,True)
+        else:
+            glbi2 = self.h_prime(glbi1,fp)
+            if self.has_room(glbi2):
+                self.placement[(glbi2,fp_key(fp))] = (self.weight,False)
+            else:
+                self.pending = (self.weight,True) # res_conflict stores fp in glbi1
+        super().insert_fingerprint(glbi1,fp,verbose,item)
+        return
+
+    def remove_and_replace(self,old_blk,gbucket_index1,gbucket_index2,old_fp,new_fp,simple=True,same_bucket=True,verbose=False):
+        success = super().remove_and_replace(old_blk,gbucket_index1,gbucket_index2,old_fp,new_fp,simple,same_bucket,verbose)
+        if success:
+            weight,primary = self.placement.pop((gbucket_index1,fp_key(old_fp)),(0,True))
+            new_glbi = gbucket_index1 if same_bucket else gbucket_index2
+            self.placement[(new_glbi,fp_key(new_fp))] = self.pending
+            # old_fp goes to its alternate bucket, now or in the next round of res_conflict
+            if simple:
+                self.placement[(self.h_prime(gbucket_index1,old_fp),fp_key(old_fp))] = (weight,not primary)
+            else:
+                self.pending = (weight,not primary)
+        return success
+
+    def move_cost(self,candidate):
+        """Change of the weighted probes if the fingerprint moves to its alternate bucket."""
+        glbi,fp = candidate
+        weight,primary = self.placement.get((glbi,fp_key(fp)),(0,True))
+        return weight if primary else -weight
+
+    def eviction_order(self,candidates):
+        return sorted(candidates,key=self.move_cost)
+
+    def pick_victim(self,candidates):
+        # random among the cheapest half, a deterministic choice could evict the same fingerprints in a cycle
+        ranked = self.eviction_order(candidates)
+        return random.choice(ranked[:max(1,(len(ranked)+1)//2)])
+
+def expected_probes(filter,weighted_items):
+    """Returns the average number of buckets a query reads, weighted by the query weights:
+    1 for an item found in its primary bucket, 2 for one found in its secondary bucket."""
+    n = filter.no_blocks*filter.no_buckets
+    total = 0
+    probes = 0
+    for item,weight in weighted_pairs(weighted_items):
+        h = mmh3.hash(item,signed=False)
+        glbi1 = filter.map(h,n)
+        fp = fingerprint_from_hash(h,filter.fingerprint_size)
+        in_primary = filter.Blocks[glbi1//filter.no_buckets].read_and_cmp(glbi1 % filter.no_buckets,fp)
+        probes += weight*(1 if in_primary else 2)
+        total += weight
+    return probes/total if total else 0.0
+
+# testing
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        weighted = dict(read_weighted_names(sys.argv[1]))
+    else:
+        # zipf query weights over a random popularity ranking
+        names = ["item"+str(i) for i in range(20000)]
+        random.shuffle(names)
+        weighted = {name:1.0/(rank+1) for rank,name in enumerate(names)}
+    no_blocks = math.ceil(len(weighted)/0.95/46)
+    random.seed(0)
+    plain = MortonFilter(no_blocks)
+    start = time.time()
+    for item in weighted:
+        plain.insert(item)
+    print("plain insert:", time.time() - start)
+    random.seed(0)
+    filter = WeightedMortonFilter(no_blocks)
+    start = time.time()
+    filter.insert_weighted(weighted)
+    print("weighted insert:", time.time() - start)
+    print(f"expected probes per query: plain {expected_probes(plain,weighted):.4f}, weighted {expected_probes(filter,weighted):.4f}")
+    for item in weighted:
+        if not filter.check(item):
+            print("query failed for: "+item)
+            sys.exit(1)
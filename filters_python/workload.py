@@ -0,0 +1,140 @@
+import sys,time,struct
+import numpy as np
+from keys import label_offsets, wire_format
+
+# Synthetic DNS traffic for the benchmarks: legitimate queries are drawn from the real
+# name lists with Zipf popularity, attack queries are random labels under victim zones
+# (water torture / random subdomain attacks). Everything is produced in batches,
+# so only the name list and one batch are in memory.
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+def top_zones(names,k=10,labels=2):
+    """Returns the k most common zones (last labels labels) of the wire format names."""
+    counts = {}
+    for name in names:
+        offsets = label_offsets(name)
+        zone = name[offsets[max(0,len(offsets)-labels)]:]
+        counts[zone] = counts.get(zone,0) + 1
+    return sorted(counts,key=counts.get,reverse=True)[:k]
+
+class Workload:
+    """Stream of wire format DNS query names.
+    names: legitimate names (wire format), queried with Zipf(zipf_s) popularity over a random ranking.
+    zones: victim zones (wire format) of the attack.
+    attack_ratio: fraction of attack queries, or give legit_rate and attack_rate (queries/sec)
+    to also get Poisson arrival times.
+    label_lengths: (min, max) of the random label for length_dist "uniform",
+    (mean, std) for "normal", or a list of lengths to draw from for "empirical".
+    attack_labels: number of random labels in front of the zone."""
+    def __init__(self,names,zones,attack_ratio=0.5,zipf_s=1.0,label_lengths=(6,16),length_dist="uniform",
+        attack_labels=1,alphabet=ALPHABET,legit_rate=None,attack_rate=None,seed=0):
+        self.names = names
+        self.zones = zones
+        self.rng = np.random.default_rng(seed)
+        self.rate = None
+        if legit_rate is not None and attack_rate is not None:
+            self.rate = legit_rate + attack_rate
+            attack_ratio = attack_rate/self.rate
+        self.attack_ratio = attack_ratio
+        self.label_lengths = label_lengths
+        self.length_dist = length_dist
+        self.attack_labels = attack_labels
+        self.alphabet = np.array(list(alphabet))
+        self.time = 0.0
+        if len(names):
+            # popularity rank -> name index, so that popularity does not follow the file order
+            self.ranking = self.rng.permutation(len(names))
+            cdf = np.cumsum(1.0/np.arange(1,len(names)+1)**zipf_s)
+            self.cdf = cdf/cdf[-1]
+
+    def legit_names(self,count):
+        ranks = np.searchsorted(self.cdf,self.rng.random(count),side="right")
+        ranks = np.minimum(ranks,len(self.names)-1) # guard against rounding of the last cdf value
+        return [self.names[i] for i in self.ranking[ranks]]
+
+    def label_length_sample(self,count):
+        if self.length_dist == "uniform":
+            lo,hi = self.label_lengths
+            lengths = self.rng.integers(lo,hi+1,count)
+        elif self.length_dist == "normal":
+            mean,std = self.label_lengths
+            lengths = np.rint(self.rng.normal(mean,std,count)).astype(np.int64)
+        elif self.length_dist == "empirical":
+            lengths = self.rng.choice(np.asarray(self.label_lengths),count)
+        else:
+            raise Exception('unknown length distribution ' + self.length_dist)
+        return np.clip(lengths,1,63) # a DNS label has 1 to 63 characters
+
+    def random_labels(self,count):
+        lengths = self.label_length_sample(count)
+        chars = self.alphabet[self.rng.integers(0,len(self.alphabet),(count,int(lengths.max())))]
+        return ["".join(row[:n]) for row,n in zip(chars,lengths)]
+
+    def attack_names(self,count):
+        zones = self.rng.integers(0,len(self.zones),count)
+        prefixes = [""]*count
+        for l in range(self.attack_labels):
+            prefixes = [p + chr(len(label)) + label for p,label in zip(prefixes,self.random_labels(count))]
+        return [p + self.zones[z] for p,z in zip(prefixes,zones)]
+
+    def batch(self,size):
+        """Returns one batch: (names, is_attack boolean array, arrival times or None)."""
+        is_attack = self.rng.random(size) < self.attack_ratio
+        no_attack = int(is_attack.sum())
+        attack = iter(self.attack_names(no_attack)) if no_attack else iter(())
+        legit = iter(self.legit_names(size - no_attack)) if size > no_attack else iter(())
+        names = [next(attack) if a else next(legit) for a in is_attack]
+        times = None
+        if self.rate:
+            times = self.time + np.cumsum(self.rng.exponential(1.0/self.rate,size))
+            self.time = float(times[-1])
+        return names, is_attack, times
+
+    def batches(self,batch_size=10000,total=None):
+        """Yields batches until total queries are produced (forever if total is None)."""
+        produced = 0
+        while total is None or produced < total:
+            size = batch_size if total is None else min(batch_size,total - produced)
+            yield self.batch(size)
+            produced += size
+
+    def negatives(self,batch_size=10000,total=None):
+        """Yields batches of attack names only, eg. as negative queries for FPR measurements."""
+        produced = 0
+        while total is None or produced < total:
+            size = batch_size if total is None else min(batch_size,total - produced)
+            yield self.attack_names(size)
+            produced += size
+
+def dns_query(name,qid=0,qtype=1):
+    """Returns the DNS query packet (UDP payload) for the wire format name, class IN."""
+    header = struct.pack("!HHHHHH",qid,0x0100,1,0,0,0) # recursion desired, one question
+    return header + name.encode() + b"\x00" + struct.pack("!HH",qtype,1)
+
+def packets(batches,seed=0):
+    """Turns batches of names into batches of DNS query packets."""
+    rng = np.random.default_rng(seed)
+    for names,is_attack,times in batches:
+        qids = rng.integers(0,1 << 16,len(names))
+        yield [dns_query(name,int(qid)) for name,qid in zip(names,qids)], is_attack, times
+
+# testing
+if __name__ == '__main__':
+    names = [wire_format(f"host{i}.example.com") for i in range(10000)] + \
+            [wire_format(f"www{i}.example.org") for i in range(5000)]
+    zones = top_zones(names)
+    print("victim zones:", zones)
+    workload = Workload(names,zones,legit_rate=8000,attack_rate=2000,seed=1)
+    start = time.time()
+    total = 0
+    attacks = 0
+    for batch_names,is_attack,times in workload.batches(10000,total=200000):
+        total += len(batch_names)
+        attacks += int(is_attack.sum())
+    end = time.time()
+    print(f"{total} queries, {attacks/total:.3f} attack ratio, {workload.time:.1f} seconds of traffic")
+    print("time elapsed:", end - start)
+    batch = next(packets(workload.batches(5,total=5)))
+    for packet in batch[0]:
+        print(packet)